@@ -1,6 +1,7 @@
+from pydantic import PrivateAttr, model_validator
 from pydantic_settings import BaseSettings
 from functools import lru_cache
-from typing import List
+from typing import Tuple
 
 
 class Settings(BaseSettings):
@@ -29,6 +30,11 @@ class Settings(BaseSettings):
 
     # OpenAI
     openai_api_key: str = ""
+    openai_description_model: str = "gpt-4o-mini"
+    openai_seo_model: str = "gpt-4o-mini"
+    openai_max_concurrency: int = 10
+    llm_cache_ttl_seconds: int = 86400
+    ai_rate_limit_storage_uri: str = "memory://"
 
     # Stripe
     stripe_secret_key: str = ""
@@ -37,9 +43,17 @@ class Settings(BaseSettings):
     stripe_professional_price_id: str = ""
     stripe_enterprise_price_id: str = ""
 
+    _cors_origins_list: Tuple[str, ...] = PrivateAttr(default=())
+
+    @model_validator(mode="after")
+    def _split_cors_origins(self) -> "Settings":
+        # Split once at load time; settings are cached by get_settings()
+        self._cors_origins_list = tuple(origin.strip() for origin in self.cors_origins.split(","))
+        return self
+
     @property
-    def cors_origins_list(self) -> List[str]:
-        return [origin.strip() for origin in self.cors_origins.split(",")]
+    def cors_origins_list(self) -> Tuple[str, ...]:
+        return self._cors_origins_list
 
     class Config:
         env_file = ".env"
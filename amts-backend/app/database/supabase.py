@@ -3,6 +3,7 @@ from typing import Optional
 from app.config import settings
 
 _supabase_client: Optional[Client] = None
+_supabase_admin_client: Optional[Client] = None
 
 
 def get_supabase() -> Client:
@@ -22,10 +23,14 @@ def get_supabase() -> Client:
 
 def get_supabase_admin() -> Client:
     """Get Supabase client with service role key for admin operations."""
-    if not settings.supabase_url or not settings.supabase_service_key:
-        raise ValueError("Supabase URL and Service Key must be configured")
+    global _supabase_admin_client
 
-    return create_client(
-        settings.supabase_url,
-        settings.supabase_service_key
-    )
+    if _supabase_admin_client is None:
+        if not settings.supabase_url or not settings.supabase_service_key:
+            raise ValueError("Supabase URL and Service Key must be configured")
+        _supabase_admin_client = create_client(
+            settings.supabase_url,
+            settings.supabase_service_key
+        )
+
+    return _supabase_admin_client
@@ -1,16 +1,75 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from contextlib import asynccontextmanager
+from fastapi.responses import ORJSONResponse
+from contextlib import asynccontextmanager, AsyncExitStack
+import importlib
 
 from app.config import settings
-from app.routers import auth, products, tasks, shopify, ai, admin
+
+# Routers are imported at startup rather than module import, so loading
+# app.main (and /health) doesn't pull in every service SDK
+ROUTER_SPECS = [
+    ("app.routers.auth", "router"),
+    ("app.routers.products", "router"),
+    ("app.routers.tasks", "router"),
+    ("app.routers.shopify", "router"),
+    ("app.routers.ai", "router"),
+    ("app.routers.admin", "router"),
+]
+
+
+def _register_routers(app: FastAPI) -> None:
+    """Import and include the API routers once per app."""
+    if getattr(app.state, "routers_registered", False):
+        return
+    for module_path, attr in ROUTER_SPECS:
+        module = importlib.import_module(module_path)
+        app.include_router(getattr(module, attr), prefix="/api")
+    app.state.routers_registered = True
+
+
+@asynccontextmanager
+async def routers_lifespan(app: FastAPI):
+    _register_routers(app)
+    yield
+
+
+@asynccontextmanager
+async def supabase_lifespan(app: FastAPI):
+    """Build the Supabase client at startup instead of on the first request."""
+    if settings.supabase_url and settings.supabase_key:
+        # Imported here so the SDK is only loaded when it's configured
+        from app.database.supabase import get_supabase
+        get_supabase()
+    yield
+
+
+@asynccontextmanager
+async def http_client_lifespan(app: FastAPI):
+    """Close the shared Shopify and OpenAI HTTP clients on shutdown."""
+    yield
+    from app.services.shopify import close_http_client
+    from app.services.openai_service import close_openai_client
+    await close_http_client()
+    await close_openai_client()
+
+
+# Sub-lifespans are entered in order and exited in reverse on shutdown
+LIFESPANS = [
+    routers_lifespan,
+    supabase_lifespan,
+    http_client_lifespan,
+]
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     print("Starting AMTS Backend...")
-    yield
+    async with AsyncExitStack() as stack:
+        for sub_lifespan in LIFESPANS:
+            await stack.enter_async_context(sub_lifespan(app))
+        yield
     # Shutdown
     print("Shutting down AMTS Backend...")
 
@@ -20,6 +79,7 @@ app = FastAPI(
     description="Advanced Marketing Theme System - Backend API for cannabis e-commerce SaaS",
     version="1.0.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 # CORS Configuration
@@ -29,16 +89,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let browsers cache preflight responses for a day
+    max_age=86400,
 )
 
-# Include routers
-app.include_router(auth.router, prefix="/api")
-app.include_router(products.router, prefix="/api")
-app.include_router(tasks.router, prefix="/api")
-app.include_router(shopify.router, prefix="/api")
-app.include_router(ai.router, prefix="/api")
-app.include_router(admin.router, prefix="/api")
-
 
 @app.get("/")
 async def root():
@@ -68,3 +122,9 @@ async def api_info():
         }
     }
 
+
+if __name__ == "__main__":
+    # Production: uvicorn app.main:app --loop uvloop --http httptools --workers N
+    import uvicorn
+
+    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, loop="uvloop", http="httptools")
@@ -1,13 +1,25 @@
-from .user import User, UserCreate, UserUpdate, UserResponse
-from .store import Store, StoreCreate, StoreUpdate, StoreResponse
-from .product import Product, ProductCreate, ProductUpdate, ProductResponse, CannabisMetafields
-from .task import Task, TaskCreate, TaskUpdate, TaskResponse
-from .subscription import Subscription, SubscriptionResponse
-
-__all__ = [
-    "User", "UserCreate", "UserUpdate", "UserResponse",
-    "Store", "StoreCreate", "StoreUpdate", "StoreResponse",
-    "Product", "ProductCreate", "ProductUpdate", "ProductResponse", "CannabisMetafields",
-    "Task", "TaskCreate", "TaskUpdate", "TaskResponse",
-    "Subscription", "SubscriptionResponse",
-]
+import importlib
+
+_LAZY = {
+    "User": "user", "UserCreate": "user", "UserUpdate": "user", "UserResponse": "user",
+    "Store": "store", "StoreCreate": "store", "StoreUpdate": "store", "StoreResponse": "store",
+    "Product": "product", "ProductCreate": "product", "ProductUpdate": "product",
+    "ProductResponse": "product", "CannabisMetafields": "product",
+    "Task": "task", "TaskCreate": "task", "TaskUpdate": "task", "TaskResponse": "task",
+    "Subscription": "subscription", "SubscriptionResponse": "subscription",
+}
+
+__all__ = tuple(_LAZY)
+
+
+def __getattr__(name):
+    # Import the submodule on first access so unused models aren't built at startup
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_LAZY[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
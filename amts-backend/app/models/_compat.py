@@ -0,0 +1,5 @@
+import sys
+from dataclasses import dataclass
+
+# In-memory row records use __slots__ where the interpreter supports it (3.10+)
+record = dataclass(slots=True) if sys.version_info >= (3, 10) else dataclass
@@ -1,8 +1,11 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import Optional, List, Dict, Any
+from dataclasses import field
 from datetime import datetime
 from enum import Enum
 
+from app.models._compat import record
+
 
 class ProductStatus(str, Enum):
     DRAFT = "draft"
@@ -77,8 +80,7 @@ class Product(ProductBase):
     created_at: datetime
     updated_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class ProductResponse(BaseModel):
@@ -101,5 +103,29 @@ class ProductResponse(BaseModel):
     synced_to_shopify: bool
     created_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True, frozen=True)
+
+
+@record
+class ProductRecord:
+    """In-memory product row (will be replaced with Supabase)."""
+    id: str
+    store_id: str
+    title: str
+    price: float
+    created_at: str
+    updated_at: str
+    shopify_product_id: Optional[str] = None
+    description: Optional[str] = None
+    compare_at_price: Optional[float] = None
+    sku: Optional[str] = None
+    barcode: Optional[str] = None
+    inventory_quantity: int = 0
+    images: List[str] = field(default_factory=list)
+    tags: List[str] = field(default_factory=list)
+    product_type: Optional[str] = None
+    vendor: Optional[str] = None
+    status: str = ProductStatus.DRAFT
+    cannabis_metafields: Optional[Dict[str, Any]] = None
+    ai_description_generated: bool = False
+    synced_to_shopify: bool = False
@@ -1,8 +1,10 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import Optional, Dict, Any
 from datetime import datetime
 from enum import Enum
 
+from app.models._compat import record
+
 
 class StoreStatus(str, Enum):
     PENDING = "pending"
@@ -43,8 +45,7 @@ class Store(StoreBase):
     created_at: datetime
     updated_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class StoreResponse(BaseModel):
@@ -59,5 +60,21 @@ class StoreResponse(BaseModel):
     last_synced: Optional[datetime] = None
     created_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True, frozen=True)
+
+
+@record
+class StoreRecord:
+    """In-memory store row (will be replaced with Supabase); access tokens are kept separately."""
+    id: str
+    user_id: str
+    name: str
+    shopify_domain: str
+    created_at: str
+    updated_at: str
+    status: str = StoreStatus.PENDING
+    industry: Optional[str] = None
+    brand_colors: Optional[Dict[str, str]] = None
+    logo_url: Optional[str] = None
+    products_count: int = 0
+    last_synced: Optional[str] = None
@@ -1,5 +1,6 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, ConfigDict
+from typing import Optional, Mapping
+from types import MappingProxyType
 from datetime import datetime
 from enum import Enum
 
@@ -35,8 +36,7 @@ class Subscription(BaseModel):
     created_at: datetime
     updated_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class SubscriptionResponse(BaseModel):
@@ -50,34 +50,39 @@ class SubscriptionResponse(BaseModel):
     ai_generations_limit: int
     products_limit: int
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True, frozen=True)
 
 
 # Subscription tier limits
-TIER_LIMITS = {
-    SubscriptionTier.FREE: {
+TIER_LIMITS: Mapping[SubscriptionTier, Mapping[str, int]] = MappingProxyType({
+    SubscriptionTier.FREE: MappingProxyType({
         "ai_generations": 10,
         "products": 50,
         "stores": 1,
         "price": 0,
-    },
-    SubscriptionTier.STARTER: {
+    }),
+    SubscriptionTier.STARTER: MappingProxyType({
         "ai_generations": 100,
         "products": 500,
         "stores": 2,
         "price": 4900,  # $49/month in cents
-    },
-    SubscriptionTier.PROFESSIONAL: {
+    }),
+    SubscriptionTier.PROFESSIONAL: MappingProxyType({
         "ai_generations": 500,
         "products": 2500,
         "stores": 5,
         "price": 9900,  # $99/month in cents
-    },
-    SubscriptionTier.ENTERPRISE: {
+    }),
+    SubscriptionTier.ENTERPRISE: MappingProxyType({
         "ai_generations": -1,  # Unlimited
         "products": -1,  # Unlimited
         "stores": -1,  # Unlimited
         "price": 29900,  # $299/month in cents
-    },
-}
+    }),
+})
+
+# AI generations per plan keyed by the plain tier string stored on user
+# records, for the AI rate limiter; -1 means unlimited
+TIER_AI_GENERATION_LIMITS: Mapping[str, int] = MappingProxyType(
+    {tier.value: limits["ai_generations"] for tier, limits in TIER_LIMITS.items()}
+)
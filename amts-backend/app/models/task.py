@@ -1,8 +1,10 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import Optional, Dict, Any
 from datetime import datetime
 from enum import Enum
 
+from app.models._compat import record
+
 
 class TaskStatus(str, Enum):
     PENDING = "pending"
@@ -61,8 +63,7 @@ class Task(TaskBase):
     created_at: datetime
     updated_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class TaskResponse(BaseModel):
@@ -80,5 +81,23 @@ class TaskResponse(BaseModel):
     completed_at: Optional[datetime] = None
     created_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True, frozen=True)
+
+
+@record
+class TaskRecord:
+    """In-memory task row (will be replaced with Supabase)."""
+    id: str
+    store_id: str
+    title: str
+    task_type: str
+    created_at: str
+    updated_at: str
+    product_id: Optional[str] = None
+    description: Optional[str] = None
+    priority: str = TaskPriority.MEDIUM
+    status: str = TaskStatus.PENDING
+    metadata: Optional[Dict[str, Any]] = None
+    result: Optional[Dict[str, Any]] = None
+    started_at: Optional[str] = None
+    completed_at: Optional[str] = None
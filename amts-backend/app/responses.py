@@ -0,0 +1,37 @@
+from typing import Any, Optional
+import hashlib
+
+import msgspec
+from fastapi import Request, status
+from fastapi.responses import Response
+
+_encoder = msgspec.json.Encoder()
+
+
+class MsgspecResponse(Response):
+    """JSON response encoded with msgspec, for handlers that return Structs."""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return _encoder.encode(content)
+
+
+def make_etag(body: bytes) -> str:
+    """Strong ETag for a response body."""
+    return f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+
+
+def etag_response(
+    request: Request,
+    body: bytes,
+    etag: Optional[str] = None,
+    cache_control: Optional[str] = None,
+) -> Response:
+    """Return body as JSON, or an empty 304 if the client already has this version."""
+    headers = {"ETag": etag or make_etag(body)}
+    if cache_control:
+        headers["Cache-Control"] = cache_control
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -1,25 +1,34 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Query
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Request, BackgroundTasks
 from pydantic import BaseModel, EmailStr
 from typing import Optional, List, Dict, Any
+from dataclasses import asdict
 from datetime import datetime
+from itertools import chain, islice
+from operator import itemgetter
+import time
+import msgspec
+import orjson
 
 from app.services.auth import (
     get_admin_user,
     get_super_admin_user,
-    get_all_users,
     get_user_by_id,
     update_user,
     delete_user,
+    intern_value,
     create_user,
     create_access_token,
     create_refresh_token,
     users_db,
+    users_search_index,
+    active_user_ids,
     ROLE_USER,
     ROLE_ADMIN,
 )
-from app.routers.shopify import stores_db
-from app.routers.products import products_db
-from app.routers.tasks import tasks_db
+from app.routers.shopify import stores_db, stores_by_user, connected_store_ids
+from app.routers.products import products_db, products_by_store
+from app.routers.tasks import tasks_db, tasks_by_store, pending_task_ids
+from app.responses import MsgspecResponse, make_etag, etag_response
 
 router = APIRouter(prefix="/admin", tags=["Admin Portal"])
 
@@ -58,47 +67,91 @@ class ClientResponse(BaseModel):
     created_at: str
 
 
+class ClientStruct(msgspec.Struct):
+    """msgspec mirror of ClientResponse used to encode client listings."""
+    id: str
+    email: str
+    full_name: Optional[str]
+    company_name: Optional[str]
+    industry: Optional[str]
+    role: str
+    subscription_tier: str
+    is_active: bool
+    onboarding_completed: bool
+    stores_count: int
+    products_count: int
+    created_at: str
+
+
 # Dashboard Stats
-@router.get("/dashboard/stats")
-async def get_admin_dashboard_stats(
-    admin_user: Dict[str, Any] = Depends(get_admin_user)
-):
-    """Get admin dashboard statistics."""
-    users = list(users_db.values())
-    stores = list(stores_db.values())
-    products = list(products_db.values())
-    tasks = list(tasks_db.values())
+# Served stale-while-revalidate: fresh for STATS_TTL_SECONDS, then the cached
+# value is returned while a background task recomputes it
+STATS_TTL_SECONDS = 5.0
+_stats_cache: Dict[str, Any] = {"body": None, "etag": "", "ts": 0.0, "refreshing": False}
 
-    # Count by subscription tier
+
+def _compute_dashboard_stats() -> Dict[str, Any]:
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+
+    # Single pass over users for tier and signup counts
     tier_counts = {}
-    for user in users:
+    recent_signups = 0
+    for user in users_db.values():
         tier = user.get("subscription_tier", "free")
         tier_counts[tier] = tier_counts.get(tier, 0) + 1
+        if user.get("created_at", "").startswith(today):
+            recent_signups += 1
 
-    # Count active vs inactive users
-    active_users = len([u for u in users if u.get("is_active", True)])
-    inactive_users = len(users) - active_users
-
-    # Count connected stores
-    connected_stores = len([s for s in stores if s.get("status") == "connected"])
+    # Active, connected and pending counts are maintained at write time
+    active_users = len(active_user_ids)
+    inactive_users = len(users_db) - active_users
 
     return {
-        "total_clients": len(users),
+        "total_clients": len(users_db),
         "active_clients": active_users,
         "inactive_clients": inactive_users,
-        "total_stores": len(stores),
-        "connected_stores": connected_stores,
-        "total_products": len(products),
-        "total_tasks": len(tasks),
-        "pending_tasks": len([t for t in tasks if t.get("status") == "pending"]),
+        "total_stores": len(stores_db),
+        "connected_stores": len(connected_store_ids),
+        "total_products": len(products_db),
+        "total_tasks": len(tasks_db),
+        "pending_tasks": len(pending_task_ids),
         "clients_by_tier": tier_counts,
-        "recent_signups": len([
-            u for u in users
-            if u.get("created_at", "")[:10] == datetime.utcnow().isoformat()[:10]
-        ]),
+        "recent_signups": recent_signups,
     }
 
 
+def _store_dashboard_stats() -> None:
+    body = orjson.dumps(_compute_dashboard_stats())
+    _stats_cache["body"] = body
+    _stats_cache["etag"] = make_etag(body)
+    _stats_cache["ts"] = time.monotonic()
+
+
+async def _refresh_stats_cache() -> None:
+    # async so BackgroundTasks runs it on the event loop, where nothing can
+    # change users_db mid-iteration, instead of in the threadpool
+    try:
+        _store_dashboard_stats()
+    finally:
+        _stats_cache["refreshing"] = False
+
+
+@router.get("/dashboard/stats")
+async def get_admin_dashboard_stats(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    admin_user: Dict[str, Any] = Depends(get_admin_user)
+):
+    """Get admin dashboard statistics."""
+    if _stats_cache["body"] is None:
+        _store_dashboard_stats()
+    elif time.monotonic() - _stats_cache["ts"] > STATS_TTL_SECONDS and not _stats_cache["refreshing"]:
+        _stats_cache["refreshing"] = True
+        background_tasks.add_task(_refresh_stats_cache)
+
+    return etag_response(request, _stats_cache["body"], etag=_stats_cache["etag"])
+
+
 # Client Management
 @router.get("/clients", response_model=List[ClientResponse])
 async def list_clients(
@@ -110,32 +163,26 @@ async def list_clients(
     admin_user: Dict[str, Any] = Depends(get_admin_user)
 ):
     """List all clients (users)."""
-    users = get_all_users()
+    users = users_db.values()
 
-    # Apply filters
+    # Apply filters lazily so only offset + limit users are ever visited past the match
     if search:
         search_lower = search.lower()
-        users = [
-            u for u in users
-            if search_lower in u.get("email", "").lower()
-            or search_lower in (u.get("full_name") or "").lower()
-            or search_lower in (u.get("company_name") or "").lower()
-        ]
+        users = (u for u in users if search_lower in users_search_index.get(u["id"], ""))
 
     if subscription_tier:
-        users = [u for u in users if u.get("subscription_tier") == subscription_tier]
+        subscription_tier = intern_value(subscription_tier)
+        users = (u for u in users if u["subscription_tier"] == subscription_tier)
 
     if is_active is not None:
-        users = [u for u in users if u.get("is_active", True) == is_active]
+        users = (u for u in users if u["is_active"] == is_active)
 
     # Get store and product counts for each user
     result = []
-    for user in users[offset:offset + limit]:
-        user_stores = [s for s in stores_db.values() if s.get("user_id") == user["id"]]
-        user_store_ids = [s["id"] for s in user_stores]
-        user_products = [p for p in products_db.values() if p.get("store_id") in user_store_ids]
+    for user in islice(users, offset, offset + limit):
+        user_stores = stores_by_user.get(user["id"], {})
 
-        result.append(ClientResponse(
+        result.append(ClientStruct(
             id=user["id"],
             email=user["email"],
             full_name=user.get("full_name"),
@@ -146,11 +193,12 @@ async def list_clients(
             is_active=user.get("is_active", True),
             onboarding_completed=user.get("onboarding_completed", False),
             stores_count=len(user_stores),
-            products_count=len(user_products),
+            products_count=sum(len(products_by_store.get(sid, ())) for sid in user_stores),
             created_at=user.get("created_at", ""),
         ))
 
-    return result
+    # ClientResponse still documents the schema; encoding skips Pydantic
+    return MsgspecResponse(result)
 
 
 @router.get("/clients/{client_id}")
@@ -167,31 +215,23 @@ async def get_client(
         )
 
     # Get user's stores
-    user_stores = [
-        {k: v for k, v in s.items() if k != "shopify_access_token"}
-        for s in stores_db.values()
-        if s.get("user_id") == client_id
-    ]
+    user_stores = list(stores_by_user.get(client_id, {}).values())
 
     # Get user's products
-    store_ids = [s["id"] for s in user_stores]
-    user_products = [
-        p for p in products_db.values()
-        if p.get("store_id") in store_ids
-    ]
+    store_ids = [s.id for s in user_stores]
+    products_count = sum(len(products_by_store.get(sid, ())) for sid in store_ids)
 
     # Get user's tasks
-    user_tasks = [
-        t for t in tasks_db.values()
-        if t.get("store_id") in store_ids
-    ]
+    user_tasks = list(chain.from_iterable(
+        tasks_by_store.get(sid, {}).values() for sid in store_ids
+    ))
 
     return {
         **user,
         "stores": user_stores,
-        "products_count": len(user_products),
+        "products_count": products_count,
         "tasks_count": len(user_tasks),
-        "pending_tasks": len([t for t in user_tasks if t.get("status") == "pending"]),
+        "pending_tasks": sum(1 for t in user_tasks if t.status == "pending"),
     }
 
 
@@ -202,7 +242,7 @@ async def create_client(
 ):
     """Create a new client (user) manually."""
     try:
-        user = create_user(
+        user = await create_user(
             email=request.email,
             password=request.password,
             full_name=request.full_name,
@@ -210,7 +250,7 @@ async def create_client(
             industry=request.industry,
             subscription_tier=request.subscription_tier,
         )
-        return {k: v for k, v in user.items() if k != "hashed_password"}
+        return user
     except HTTPException:
         raise
     except Exception as e:
@@ -264,20 +304,20 @@ async def list_all_stores(
     admin_user: Dict[str, Any] = Depends(get_admin_user)
 ):
     """List all stores across all clients."""
-    stores = list(stores_db.values())
-
     if client_id:
-        stores = [s for s in stores if s.get("user_id") == client_id]
+        stores = list(stores_by_user.get(client_id, {}).values())
+    else:
+        stores = list(stores_db.values())
 
     if status:
-        stores = [s for s in stores if s.get("status") == status]
+        stores = [s for s in stores if s.status == status]
 
     # Add client info to each store
     result = []
     for store in stores[offset:offset + limit]:
-        user = get_user_by_id(store.get("user_id", ""))
+        user = get_user_by_id(store.user_id)
         result.append({
-            **{k: v for k, v in store.items() if k != "shopify_access_token"},
+            **asdict(store),
             "client_email": user.get("email") if user else None,
             "client_name": user.get("full_name") if user else None,
         })
@@ -298,18 +338,18 @@ async def get_store_details(
         )
 
     store = stores_db[store_id]
-    user = get_user_by_id(store.get("user_id", ""))
+    user = get_user_by_id(store.user_id)
 
     # Get store products
-    store_products = [p for p in products_db.values() if p.get("store_id") == store_id]
+    store_products = products_by_store.get(store_id, {})
 
     # Get store tasks
-    store_tasks = [t for t in tasks_db.values() if t.get("store_id") == store_id]
+    store_tasks = tasks_by_store.get(store_id, {})
 
     return {
-        **{k: v for k, v in store.items() if k != "shopify_access_token"},
+        **asdict(store),
         "client": user,
-        "products": store_products[:10],  # First 10 products
+        "products": list(islice(store_products.values(), 10)),  # First 10 products
         "products_count": len(store_products),
         "tasks_count": len(store_tasks),
     }
@@ -355,26 +395,26 @@ async def get_activity_log(
     activities = []
 
     # Generate mock activity from existing data
-    for user in list(users_db.values())[:10]:
+    for user in islice(users_db.values(), 10):
         activities.append({
             "id": f"activity-{user['id'][:8]}",
             "type": "user_created",
             "description": f"User {user.get('email')} was created",
             "user_id": user["id"],
-            "timestamp": user.get("created_at"),
+            "timestamp": user.get("created_at") or "",
         })
 
-    for store in list(stores_db.values())[:10]:
+    for store in islice(stores_db.values(), 10):
         activities.append({
-            "id": f"activity-{store['id'][:8]}",
+            "id": f"activity-{store.id[:8]}",
             "type": "store_connected",
-            "description": f"Store {store.get('shopify_domain')} was connected",
-            "store_id": store["id"],
-            "timestamp": store.get("created_at"),
+            "description": f"Store {store.shopify_domain} was connected",
+            "store_id": store.id,
+            "timestamp": store.created_at or "",
         })
 
     # Sort by timestamp
-    activities.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
+    activities.sort(key=itemgetter("timestamp"), reverse=True)
 
     if client_id:
         activities = [a for a in activities if a.get("user_id") == client_id]
@@ -403,14 +443,11 @@ async def masquerade_as_client(
     access_token = create_access_token(data={"sub": user["id"]})
     refresh_token = create_refresh_token(user["id"])
 
-    # Return user data without sensitive info
-    user_data = {k: v for k, v in user.items() if k != "hashed_password"}
-
     return {
         "access_token": access_token,
         "refresh_token": refresh_token,
         "token_type": "bearer",
-        "user": user_data,
+        "user": user,
         "masquerading": True,
         "admin_id": admin_user["id"],
         "admin_email": admin_user["email"],
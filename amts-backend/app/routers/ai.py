@@ -1,14 +1,65 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Query
+from fastapi import APIRouter, HTTPException, status, Depends, Query, BackgroundTasks
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List
-import json
+from typing import Optional, List, Dict, Any, AsyncIterator
+from datetime import datetime
+from functools import partial
+import asyncio
+import orjson
 
+from app.config import settings
+from app.models.task import TaskResponse, TaskStatus, TaskType
 from app.services.auth import get_current_user
-from app.services.openai_service import openai_service
+from app.services.openai_service import openai_service, call_with_retry, cached_llm_call
+from app.services.rate_limit import charge_ai_quota, get_ai_usage
+from app.services.concurrency import bounded_gather
 
 router = APIRouter(prefix="/ai", tags=["AI Content Generation"])
 
+# Products per completion in bulk generation
+BULK_DESCRIPTION_BATCH_SIZE = 8
+# From this many products, bulk generation goes through the OpenAI Batch API,
+# which is half the price but can take up to its 24h completion window
+BATCH_API_MIN_PRODUCTS = 50
+
+# Streamed tokens are merged into one SSE frame until the frame holds this many
+# characters or no new token has arrived for STREAM_FLUSH_INTERVAL seconds
+STREAM_FLUSH_CHARS = 96
+STREAM_FLUSH_INTERVAL = 0.02
+
+
+async def _coalesce_chunks(source: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Merge small streamed chunks into larger pieces without delaying output for long."""
+    buffer: List[str] = []
+    buffered = 0
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(source.__anext__())
+            if buffer:
+                # Flush what we have if the next chunk is slow to arrive
+                done, _ = await asyncio.wait({pending}, timeout=STREAM_FLUSH_INTERVAL)
+                if not done:
+                    yield "".join(buffer)
+                    buffer, buffered = [], 0
+                    continue
+            try:
+                chunk = await pending
+            except StopAsyncIteration:
+                break
+            pending = None
+            buffer.append(chunk)
+            buffered += len(chunk)
+            if buffered >= STREAM_FLUSH_CHARS:
+                yield "".join(buffer)
+                buffer, buffered = [], 0
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+
 
 class GenerateDescriptionRequest(BaseModel):
     product_name: str
@@ -35,7 +86,10 @@ async def generate_description(
     current_user: dict = Depends(get_current_user)
 ):
     """Generate AI product description."""
-    description = await openai_service.generate_product_description(
+    # Descriptions run at temperature 0.7 and aren't cached, so asking again
+    # gives new text; only SEO content (0.5) goes through cached_llm_call
+    charge_ai_quota(current_user)
+    description = await call_with_retry(lambda: openai_service.generate_product_description(
         product_name=request.product_name,
         product_type=request.product_type,
         brand=request.brand,
@@ -47,7 +101,7 @@ async def generate_description(
         flavors=request.flavors,
         tone=request.tone,
         length=request.length,
-    )
+    ))
 
     return {
         "description": description,
@@ -63,9 +117,10 @@ async def generate_description_stream(
     current_user: dict = Depends(get_current_user)
 ):
     """Stream AI product description generation."""
+    charge_ai_quota(current_user)
 
     async def stream_generator():
-        async for chunk in openai_service.generate_product_description_stream(
+        async for text in _coalesce_chunks(openai_service.generate_product_description_stream(
             product_name=request.product_name,
             product_type=request.product_type,
             brand=request.brand,
@@ -77,9 +132,9 @@ async def generate_description_stream(
             flavors=request.flavors,
             tone=request.tone,
             length=request.length,
-        ):
-            yield f"data: {json.dumps({'content': chunk})}\n\n"
-        yield "data: [DONE]\n\n"
+        )):
+            yield b"data: " + orjson.dumps({"content": text}) + b"\n\n"
+        yield b"data: [DONE]\n\n"
 
     return StreamingResponse(
         stream_generator(),
@@ -97,63 +152,78 @@ async def generate_seo(
     current_user: dict = Depends(get_current_user)
 ):
     """Generate SEO meta content."""
-    seo_content = await openai_service.generate_seo_content(
+    seo_content = await cached_llm_call("generate_seo", request.model_dump(), lambda: openai_service.generate_seo_content(
         product_name=request.product_name,
         description=request.description,
-    )
+    ), on_miss=partial(charge_ai_quota, current_user))
 
     return seo_content
 
 
-@router.post("/bulk-generate")
-async def bulk_generate_descriptions(
-    product_ids: List[str],
-    tone: str = Query(default="professional"),
-    length: str = Query(default="medium"),
-    current_user: dict = Depends(get_current_user)
-):
-    """Bulk generate descriptions for multiple products."""
-    from app.routers.products import products_db
-    from datetime import datetime
+async def _generate_descriptions(product_ids: List[str], tone: str, length: str) -> Dict[str, Any]:
+    """Generate and store descriptions for the given products."""
+    from app.routers.products import products_db, product_generation_input
+
+    # Products are sent BULK_DESCRIPTION_BATCH_SIZE to a completion, and the
+    # batches run concurrently since they're independent and network-bound
+    async def generate_batch(batch_ids: List[str]) -> List[str]:
+        items = [product_generation_input(products_db[product_id]) for product_id in batch_ids]
+
+        return await call_with_retry(lambda: openai_service.generate_product_descriptions_batch(
+            items, tone=tone, length=length,
+        ))
 
     results = []
     errors = []
 
+    found_ids = []
     for product_id in product_ids:
-        if product_id not in products_db:
+        if product_id in products_db:
+            found_ids.append(product_id)
+        else:
             errors.append({"product_id": product_id, "error": "Product not found"})
-            continue
 
-        product = products_db[product_id]
-        cannabis_meta = product.get("cannabis_metafields") or {}
-
-        try:
-            description = await openai_service.generate_product_description(
-                product_name=product["title"],
-                product_type=product.get("product_type"),
-                strain_type=cannabis_meta.get("strain_type"),
-                thc_percentage=cannabis_meta.get("thc_percentage"),
-                cbd_percentage=cannabis_meta.get("cbd_percentage"),
-                terpenes=cannabis_meta.get("terpenes"),
-                effects=cannabis_meta.get("effects"),
-                flavors=cannabis_meta.get("flavors"),
-                tone=tone,
-                length=length,
-            )
-
-            products_db[product_id]["description"] = description
-            products_db[product_id]["ai_description_generated"] = True
-            products_db[product_id]["updated_at"] = datetime.utcnow().isoformat()
+    if openai_service.client and len(found_ids) >= BATCH_API_MIN_PRODUCTS:
+        descriptions = await openai_service.generate_product_descriptions_batch_api(
+            {product_id: product_generation_input(products_db[product_id]) for product_id in found_ids},
+            tone=tone, length=length,
+        )
+        batches = [found_ids]
+        outcomes = [[descriptions.get(product_id) for product_id in found_ids]]
+    else:
+        batches = [
+            found_ids[i:i + BULK_DESCRIPTION_BATCH_SIZE]
+            for i in range(0, len(found_ids), BULK_DESCRIPTION_BATCH_SIZE)
+        ]
+        outcomes = await bounded_gather(
+            (partial(generate_batch, batch) for batch in batches),
+            limit=settings.openai_max_concurrency,
+        )
 
+    now = datetime.utcnow().isoformat()
+    for batch, outcome in zip(batches, outcomes):
+        # bounded_gather hands back any BaseException, CancelledError included
+        if isinstance(outcome, BaseException):
+            errors.extend({"product_id": product_id, "error": str(outcome)} for product_id in batch)
+            continue
+        for product_id, description in zip(batch, outcome):
+            if description is None:
+                errors.append({"product_id": product_id, "error": "No description was generated"})
+                continue
+            # The product may have been deleted while the batch was in flight
+            product = products_db.get(product_id)
+            if product is None:
+                errors.append({"product_id": product_id, "error": "Product not found"})
+                continue
+            product.description = description
+            product.ai_description_generated = True
+            product.updated_at = now
             results.append({
                 "product_id": product_id,
-                "title": product["title"],
+                "title": product.title,
                 "description": description,
             })
 
-        except Exception as e:
-            errors.append({"product_id": product_id, "error": str(e)})
-
     return {
         "generated": len(results),
         "errors": errors,
@@ -161,18 +231,90 @@ async def bulk_generate_descriptions(
     }
 
 
+async def _run_bulk_generation(job, product_ids: List[str], tone: str, length: str) -> None:
+    """Run bulk generation in the background and record the outcome on the job."""
+    from app.routers.tasks import set_task_status
+
+    set_task_status(job, TaskStatus.IN_PROGRESS)
+    try:
+        result = await _generate_descriptions(product_ids, tone, length)
+    except Exception as e:
+        set_task_status(job, TaskStatus.FAILED, {"error": str(e)})
+        return
+    set_task_status(job, TaskStatus.COMPLETED, result)
+
+
+@router.post("/bulk-generate", status_code=status.HTTP_202_ACCEPTED)
+async def bulk_generate_descriptions(
+    product_ids: List[str],
+    background_tasks: BackgroundTasks,
+    tone: str = Query(default="professional"),
+    length: str = Query(default="medium"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Queue bulk description generation; poll /ai/bulk-generate/{job_id} for the result."""
+    from app.routers.products import products_db
+    from app.routers.tasks import create_job
+
+    # Each product that exists is a generation against the caller's quota
+    found = [product for product in map(products_db.get, product_ids) if product is not None]
+    if found:
+        charge_ai_quota(current_user, cost=len(found))
+
+    job = create_job(
+        store_id=found[0].store_id if found else "",
+        task_type=TaskType.CONTENT_GENERATION,
+        title=f"Generate descriptions for {len(product_ids)} products",
+        metadata={"user_id": current_user["id"], "total": len(product_ids), "tone": tone, "length": length},
+    )
+    background_tasks.add_task(_run_bulk_generation, job, product_ids, tone, length)
+
+    return {"job_id": job.id, "status": "queued"}
+
+
+@router.get("/bulk-generate/{job_id}", response_model=TaskResponse)
+async def get_bulk_generation_job(
+    job_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get the status and result of a bulk generation."""
+    from app.routers.tasks import tasks_db
+
+    job = tasks_db.get(job_id)
+    # Other users' jobs are reported as missing rather than forbidden
+    if (
+        job is None
+        or job.task_type != TaskType.CONTENT_GENERATION
+        or (job.metadata or {}).get("user_id") != current_user["id"]
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Generation job not found"
+        )
+    return job
+
+
 @router.get("/usage")
 async def get_usage(
     current_user: dict = Depends(get_current_user)
 ):
     """Get AI generation usage statistics."""
-    # In production, this would query the database
-    # For now, return mock data
+    usage = get_ai_usage(current_user)
+    if usage["limit"] < 0:
+        # Unlimited tiers aren't counted, matching -1 in the plan limits
+        return {
+            "user_id": current_user["id"],
+            "tier": current_user.get("subscription_tier", "free"),
+            "generations_used": None,
+            "generations_limit": -1,
+            "remaining": -1,
+            "reset_date": None,
+        }
     return {
         "user_id": current_user["id"],
         "tier": current_user.get("subscription_tier", "free"),
-        "generations_used": 5,
-        "generations_limit": 10,
-        "remaining": 5,
-        "reset_date": "2025-02-01",
+        "generations_used": usage["limit"] - usage["remaining"],
+        "generations_limit": usage["limit"],
+        "remaining": usage["remaining"],
+        "reset_date": datetime.utcfromtimestamp(usage["reset_at"]).isoformat(),
     }
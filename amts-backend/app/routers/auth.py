@@ -1,4 +1,5 @@
 from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, EmailStr
 from typing import Optional
 from datetime import timedelta
@@ -10,12 +11,16 @@ from app.services.auth import (
     create_refresh_token,
     decode_token,
     get_current_user,
+    index_user,
     users_db,
 )
 from app.config import settings
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
+# Profile fields users may change on themselves
+_PROFILE_FIELDS = frozenset(("full_name", "company_name", "industry", "avatar_url", "onboarding_completed"))
+
 
 class SignupRequest(BaseModel):
     email: EmailStr
@@ -43,7 +48,7 @@ class RefreshRequest(BaseModel):
 async def signup(request: SignupRequest):
     """Register a new user."""
     try:
-        user = create_user(
+        user = await create_user(
             email=request.email,
             password=request.password,
             full_name=request.full_name
@@ -52,13 +57,10 @@ async def signup(request: SignupRequest):
         access_token = create_access_token(data={"sub": user["id"]})
         refresh_token = create_refresh_token(user["id"])
 
-        # Return user without password
-        user_response = {k: v for k, v in user.items() if k != "hashed_password"}
-
         return TokenResponse(
             access_token=access_token,
             refresh_token=refresh_token,
-            user=user_response
+            user=user
         )
     except HTTPException:
         raise
@@ -72,7 +74,8 @@ async def signup(request: SignupRequest):
 @router.post("/login", response_model=TokenResponse)
 async def login(request: LoginRequest):
     """Authenticate user and return tokens."""
-    user = authenticate_user(request.email, request.password)
+    # bcrypt verification is deliberately slow; keep it off the event loop
+    user = await run_in_threadpool(authenticate_user, request.email, request.password)
 
     if not user:
         raise HTTPException(
@@ -84,13 +87,10 @@ async def login(request: LoginRequest):
     access_token = create_access_token(data={"sub": user["id"]})
     refresh_token = create_refresh_token(user["id"])
 
-    # Return user without password
-    user_response = {k: v for k, v in user.items() if k != "hashed_password"}
-
     return TokenResponse(
         access_token=access_token,
         refresh_token=refresh_token,
-        user=user_response
+        user=user
     )
 
 
@@ -116,19 +116,17 @@ async def refresh_token(request: RefreshRequest):
     access_token = create_access_token(data={"sub": user_id})
     new_refresh_token = create_refresh_token(user_id)
 
-    user_response = {k: v for k, v in user.items() if k != "hashed_password"}
-
     return TokenResponse(
         access_token=access_token,
         refresh_token=new_refresh_token,
-        user=user_response
+        user=user
     )
 
 
 @router.get("/me")
 async def get_me(current_user: dict = Depends(get_current_user)):
     """Get current user profile."""
-    return {k: v for k, v in current_user.items() if k != "hashed_password"}
+    return current_user
 
 
 @router.put("/me")
@@ -139,13 +137,11 @@ async def update_me(
     """Update current user profile."""
     user_id = current_user["id"]
 
-    allowed_fields = ["full_name", "company_name", "industry", "avatar_url", "onboarding_completed"]
-
-    for field in allowed_fields:
-        if field in updates:
-            users_db[user_id][field] = updates[field]
+    for field in _PROFILE_FIELDS & updates.keys():
+        users_db[user_id][field] = updates[field]
+    index_user(users_db[user_id])
 
-    return {k: v for k, v in users_db[user_id].items() if k != "hashed_password"}
+    return users_db[user_id]
 
 
 @router.post("/logout")
@@ -153,6 +149,5 @@ async def logout(current_user: dict = Depends(get_current_user)):
     """Logout user (invalidate refresh token)."""
     from app.services.auth import refresh_tokens_db
     user_id = current_user["id"]
-    if user_id in refresh_tokens_db:
-        del refresh_tokens_db[user_id]
+    refresh_tokens_db.pop(user_id, None)
     return {"message": "Logged out successfully"}
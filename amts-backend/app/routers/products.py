@@ -1,25 +1,166 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Query
-from typing import Optional, List, Dict, Any
+from fastapi import APIRouter, HTTPException, status, Depends, Query, BackgroundTasks, Request
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter
+from typing import Optional, List, Dict, Any, Iterator, AsyncIterator
+from collections import defaultdict
 from datetime import datetime
+from itertools import islice
+import asyncio
 import uuid
 
 from app.services.auth import get_current_user
+from app.services.rate_limit import charge_ai_quota
 from app.models.product import (
     ProductCreate,
     ProductUpdate,
     ProductResponse,
     ProductStatus,
     CannabisMetafields,
+    ProductRecord,
 )
+from app.models.task import TaskResponse, TaskStatus, TaskType, TaskRecord
+from app.routers.tasks import tasks_db, create_job, set_task_status
+from app.responses import etag_response
 
 router = APIRouter(prefix="/products", tags=["Products"])
 
 # In-memory product storage (will be replaced with Supabase)
-products_db: Dict[str, Dict[str, Any]] = {}
+products_db: Dict[str, ProductRecord] = {}
 
+# Secondary indexes, maintained by add_product/remove_product:
+# store_id -> {product_id: product}, status -> {product_id: product}, and
+# product_id -> lowercased title for search
+products_by_store: Dict[str, Dict[str, ProductRecord]] = defaultdict(dict)
+products_by_status: Dict[str, Dict[str, ProductRecord]] = defaultdict(dict)
+product_titles: Dict[str, str] = {}
+# shopify_product_id -> product_id, so syncs can match products without a scan
+products_by_shopify_id: Dict[str, str] = {}
 
-@router.get("", response_model=List[ProductResponse])
+# Cannabis metafields passed to description generation, flattened per product at write time
+AI_CONTEXT_FIELDS = ("strain_type", "thc_percentage", "cbd_percentage", "terpenes", "effects", "flavors")
+product_ai_context: Dict[str, Dict[str, Any]] = {}
+
+
+def _build_ai_context(product: ProductRecord) -> Dict[str, Any]:
+    cannabis_meta = product.cannabis_metafields or {}
+    return {key: cannabis_meta.get(key) for key in AI_CONTEXT_FIELDS}
+
+
+def product_generation_input(product: ProductRecord) -> Dict[str, Any]:
+    """Keyword arguments describing a product to the description generators."""
+    return {
+        "product_name": product.title,
+        "product_type": product.product_type,
+        **product_ai_context[product.id],
+    }
+
+
+async def generate_for_product(product: ProductRecord, tone: str, length: str) -> str:
+    """Generate a description for a stored product, retrying transient OpenAI errors.
+
+    Not cached: descriptions run at temperature 0.7, and regenerating an
+    unchanged product is expected to give new text.
+    """
+    from app.services.openai_service import openai_service, call_with_retry
+
+    return await call_with_retry(lambda: openai_service.generate_product_description(
+        tone=tone,
+        length=length,
+        **product_generation_input(product),
+    ))
+
+
+# Product reads are private to the user and change slowly; let browsers reuse
+# them briefly and revalidate with If-None-Match after that
+PRODUCTS_CACHE_CONTROL = "private, max-age=10"
+_product_list_adapter = TypeAdapter(List[ProductResponse])
+# Largest page /products/stream will serve
+PRODUCTS_STREAM_MAX_LIMIT = 10_000
+
+
+def _index_product(product: ProductRecord) -> None:
+    products_by_store[product.store_id][product.id] = product
+    products_by_status[product.status][product.id] = product
+
+
+def _unindex_product(product_id: str, store_id: str, product_status: str) -> None:
+    for index, key in ((products_by_store, store_id), (products_by_status, product_status)):
+        bucket = index.get(key)
+        if bucket is not None:
+            bucket.pop(product_id, None)
+            if not bucket:
+                del index[key]
+
+
+def _unlink_shopify_id(product: ProductRecord) -> None:
+    if product.shopify_product_id and products_by_shopify_id.get(product.shopify_product_id) == product.id:
+        del products_by_shopify_id[product.shopify_product_id]
+
+
+def link_shopify_product(product: ProductRecord, shopify_product_id: Optional[str]) -> None:
+    """Set a product's Shopify id and keep products_by_shopify_id in step."""
+    _unlink_shopify_id(product)
+    product.shopify_product_id = shopify_product_id
+    if shopify_product_id:
+        products_by_shopify_id[shopify_product_id] = product.id
+
+
+def add_product(product: ProductRecord) -> None:
+    """Insert or replace a product and index it by store and status."""
+    previous = products_db.get(product.id)
+    if previous is not None:
+        _unindex_product(previous.id, previous.store_id, previous.status)
+        _unlink_shopify_id(previous)
+    products_db[product.id] = product
+    if product.shopify_product_id:
+        products_by_shopify_id[product.shopify_product_id] = product.id
+    product_titles[product.id] = product.title.lower()
+    product_ai_context[product.id] = _build_ai_context(product)
+    _index_product(product)
+
+
+def remove_product(product_id: str) -> Optional[ProductRecord]:
+    """Remove a product and drop it from the secondary indexes."""
+    product = products_db.pop(product_id, None)
+    product_titles.pop(product_id, None)
+    product_ai_context.pop(product_id, None)
+    if product is not None:
+        _unindex_product(product_id, product.store_id, product.status)
+        _unlink_shopify_id(product)
+    return product
+
+
+def _iter_products(
+    store_id: Optional[str],
+    product_status: Optional[ProductStatus],
+    search: Optional[str],
+) -> Iterator[ProductRecord]:
+    """Lazily yield the products matching the list filters."""
+    # Walk the smallest matching index and probe the others, like a set intersection
+    indexes = []
+    if store_id:
+        indexes.append(products_by_store.get(store_id, {}))
+    if product_status:
+        indexes.append(products_by_status.get(product_status, {}))
+
+    if indexes:
+        base = min(indexes, key=len)
+        others = [index for index in indexes if index is not base]
+        products = (p for pid, p in base.items() if all(pid in index for index in others))
+    else:
+        products = products_db.values()
+
+    # Search by title
+    if search:
+        search_lower = search.lower()
+        products = (p for p in products if search_lower in product_titles[p.id])
+
+    return iter(products)
+
+
+@router.get("", response_model=List[ProductResponse], response_model_exclude_none=True)
 async def get_products(
+    request: Request,
     store_id: Optional[str] = None,
     status: Optional[ProductStatus] = None,
     search: Optional[str] = None,
@@ -28,40 +169,77 @@ async def get_products(
     current_user: dict = Depends(get_current_user)
 ):
     """Get all products for the current user."""
-    products = list(products_db.values())
+    # Paginate without materialising rows past the requested page
+    rows = list(islice(_iter_products(store_id, status, search), offset, offset + limit))
+    body = _product_list_adapter.dump_json(
+        _product_list_adapter.validate_python(rows, from_attributes=True),
+        exclude_none=True,
+    )
+    return etag_response(request, body, cache_control=PRODUCTS_CACHE_CONTROL)
 
-    # Filter by store_id if provided
-    if store_id:
-        products = [p for p in products if p.get("store_id") == store_id]
 
-    # Filter by status
-    if status:
-        products = [p for p in products if p.get("status") == status]
+async def _stream_json_array(products: Iterator[ProductRecord]) -> AsyncIterator[bytes]:
+    """Encode products as a JSON array one row at a time."""
+    yield b"["
+    separator = b""
+    for product in products:
+        row = ProductResponse.model_validate(product)
+        yield separator + row.model_dump_json(exclude_none=True).encode()
+        separator = b","
+    yield b"]"
 
-    # Search by title
-    if search:
-        search_lower = search.lower()
-        products = [p for p in products if search_lower in p.get("title", "").lower()]
 
-    # Paginate
-    total = len(products)
-    products = products[offset:offset + limit]
+@router.get("/stream", response_model=List[ProductResponse], response_model_exclude_none=True)
+async def stream_products(
+    store_id: Optional[str] = None,
+    status: Optional[ProductStatus] = None,
+    search: Optional[str] = None,
+    limit: int = Query(default=1000, le=PRODUCTS_STREAM_MAX_LIMIT),
+    offset: int = Query(default=0, ge=0),
+    current_user: dict = Depends(get_current_user)
+):
+    """Stream large product listings without buffering the whole page."""
+    # Snapshot the matching rows (references only) so writes made while the
+    # response is streaming can't mutate the indexes mid-iteration; only the
+    # encoded output is produced incrementally
+    rows = list(islice(_iter_products(store_id, status, search), offset, offset + limit))
+    return StreamingResponse(_stream_json_array(iter(rows)), media_type="application/json")
 
-    return products
+
+@router.get("/count")
+async def count_products(
+    store_id: Optional[str] = None,
+    status: Optional[ProductStatus] = None,
+    search: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Count the products matching the list filters."""
+    if not search and not (store_id and status):
+        # A single index (or none) already knows its size
+        if store_id:
+            return {"count": len(products_by_store.get(store_id, ()))}
+        if status:
+            return {"count": len(products_by_status.get(status, ()))}
+        return {"count": len(products_db)}
+    return {"count": sum(1 for _ in _iter_products(store_id, status, search))}
 
 
 @router.get("/{product_id}", response_model=ProductResponse)
 async def get_product(
     product_id: str,
+    request: Request,
     current_user: dict = Depends(get_current_user)
 ):
     """Get a specific product."""
-    if product_id not in products_db:
+    try:
+        product = products_db[product_id]
+    except KeyError:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Product not found"
-        )
-    return products_db[product_id]
+        ) from None
+    body = ProductResponse.model_validate(product).model_dump_json().encode()
+    return etag_response(request, body, cache_control=PRODUCTS_CACHE_CONTROL)
 
 
 @router.post("", response_model=ProductResponse)
@@ -73,30 +251,16 @@ async def create_product(
     product_id = str(uuid.uuid4())
     now = datetime.utcnow().isoformat()
 
-    product_data = {
-        "id": product_id,
-        "store_id": product.store_id,
-        "shopify_product_id": product.shopify_product_id,
-        "title": product.title,
-        "description": product.description,
-        "price": product.price,
-        "compare_at_price": product.compare_at_price,
-        "sku": product.sku,
-        "barcode": product.barcode,
-        "inventory_quantity": product.inventory_quantity,
-        "images": product.images,
-        "tags": product.tags,
-        "product_type": product.product_type,
-        "vendor": product.vendor,
-        "status": ProductStatus.DRAFT,
-        "cannabis_metafields": product.cannabis_metafields.model_dump() if product.cannabis_metafields else None,
-        "ai_description_generated": False,
-        "synced_to_shopify": False,
-        "created_at": now,
-        "updated_at": now,
-    }
+    # Status, flags and timestamps are server-side; everything else comes from the
+    # payload. Unset fields, including unset metafields, take the record defaults
+    product_data = ProductRecord(
+        **product.model_dump(exclude_none=True),
+        id=product_id,
+        created_at=now,
+        updated_at=now,
+    )
 
-    products_db[product_id] = product_data
+    add_product(product_data)
     return product_data
 
 
@@ -107,24 +271,32 @@ async def update_product(
     current_user: dict = Depends(get_current_user)
 ):
     """Update a product."""
-    if product_id not in products_db:
+    try:
+        product = products_db[product_id]
+    except KeyError:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Product not found"
-        )
-
-    product = products_db[product_id]
+        ) from None
+    previous_keys = (product.store_id, product.status)
 
     # Update fields that were provided
     update_data = updates.model_dump(exclude_unset=True)
     for field, value in update_data.items():
         if field == "cannabis_metafields" and value:
-            product[field] = value if isinstance(value, dict) else value.model_dump()
+            # Keep only the metafields that are set; readers treat missing keys as None
+            product.cannabis_metafields = {k: v for k, v in value.items() if v is not None}
         else:
-            product[field] = value
+            setattr(product, field, value)
 
-    product["updated_at"] = datetime.utcnow().isoformat()
-    products_db[product_id] = product
+    if (product.store_id, product.status) != previous_keys:
+        _unindex_product(product_id, *previous_keys)
+        _index_product(product)
+    if "title" in update_data:
+        product_titles[product_id] = product.title.lower()
+    if "cannabis_metafields" in update_data:
+        product_ai_context[product_id] = _build_ai_context(product)
+    product.updated_at = datetime.utcnow().isoformat()
 
     return product
 
@@ -135,13 +307,11 @@ async def delete_product(
     current_user: dict = Depends(get_current_user)
 ):
     """Delete a product."""
-    if product_id not in products_db:
+    if remove_product(product_id) is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Product not found"
         )
-
-    del products_db[product_id]
     return {"message": "Product deleted successfully"}
 
 
@@ -153,34 +323,21 @@ async def generate_product_description(
     current_user: dict = Depends(get_current_user)
 ):
     """Generate AI description for a product."""
-    from app.services.openai_service import openai_service
-
-    if product_id not in products_db:
+    try:
+        product = products_db[product_id]
+    except KeyError:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Product not found"
-        )
+        ) from None
 
-    product = products_db[product_id]
-    cannabis_meta = product.get("cannabis_metafields") or {}
-
-    description = await openai_service.generate_product_description(
-        product_name=product["title"],
-        product_type=product.get("product_type"),
-        strain_type=cannabis_meta.get("strain_type"),
-        thc_percentage=cannabis_meta.get("thc_percentage"),
-        cbd_percentage=cannabis_meta.get("cbd_percentage"),
-        terpenes=cannabis_meta.get("terpenes"),
-        effects=cannabis_meta.get("effects"),
-        flavors=cannabis_meta.get("flavors"),
-        tone=tone,
-        length=length,
-    )
+    charge_ai_quota(current_user)
+    description = await generate_for_product(product, tone, length)
 
     # Update the product with generated description
-    products_db[product_id]["description"] = description
-    products_db[product_id]["ai_description_generated"] = True
-    products_db[product_id]["updated_at"] = datetime.utcnow().isoformat()
+    product.description = description
+    product.ai_description_generated = True
+    product.updated_at = datetime.utcnow().isoformat()
 
     return {
         "product_id": product_id,
@@ -189,50 +346,84 @@ async def generate_product_description(
     }
 
 
-@router.post("/bulk-import")
+# Rows imported between yields to the event loop in background imports
+BULK_IMPORT_YIELD_EVERY = 100
+
+
+async def _run_bulk_import(job: TaskRecord, products: List[ProductCreate]) -> None:
+    """Import products in the background and record the outcome on the job."""
+    set_task_status(job, TaskStatus.IN_PROGRESS)
+    created = []
+    errors = []
+    # One timestamp for the whole import
+    now = datetime.utcnow().isoformat()
+
+    try:
+        for i, product in enumerate(products):
+            try:
+                product_id = str(uuid.uuid4())
+
+                # Status, flags and timestamps are server-side; everything else comes from the
+                # payload. Unset fields, including unset metafields, take the record defaults
+                product_data = ProductRecord(
+                    **product.model_dump(exclude_none=True),
+                    id=product_id,
+                    created_at=now,
+                    updated_at=now,
+                )
+
+                add_product(product_data)
+                created.append(product_id)
+            except Exception as e:
+                errors.append({"index": i, "error": str(e)})
+
+            # Let other requests run during large imports
+            if i % BULK_IMPORT_YIELD_EVERY == BULK_IMPORT_YIELD_EVERY - 1:
+                await asyncio.sleep(0)
+    except Exception as e:
+        set_task_status(job, TaskStatus.FAILED, {"error": str(e), "created": len(created)})
+        return
+
+    set_task_status(job, TaskStatus.COMPLETED, {
+        "created": len(created),
+        "errors": errors,
+        "product_ids": created,
+    })
+
+
+@router.post("/bulk-import", status_code=status.HTTP_202_ACCEPTED)
 async def bulk_import_products(
     products: List[ProductCreate],
+    background_tasks: BackgroundTasks,
     current_user: dict = Depends(get_current_user)
 ):
-    """Bulk import products."""
-    created = []
-    errors = []
+    """Queue a bulk product import; poll /products/bulk-import/{job_id} for the result."""
+    job = create_job(
+        store_id=products[0].store_id if products else "",
+        task_type=TaskType.BULK_IMPORT,
+        title=f"Bulk import of {len(products)} products",
+        metadata={"user_id": current_user["id"], "total": len(products)},
+    )
+    background_tasks.add_task(_run_bulk_import, job, products)
 
-    for i, product in enumerate(products):
-        try:
-            product_id = str(uuid.uuid4())
-            now = datetime.utcnow().isoformat()
-
-            product_data = {
-                "id": product_id,
-                "store_id": product.store_id,
-                "shopify_product_id": product.shopify_product_id,
-                "title": product.title,
-                "description": product.description,
-                "price": product.price,
-                "compare_at_price": product.compare_at_price,
-                "sku": product.sku,
-                "barcode": product.barcode,
-                "inventory_quantity": product.inventory_quantity,
-                "images": product.images,
-                "tags": product.tags,
-                "product_type": product.product_type,
-                "vendor": product.vendor,
-                "status": ProductStatus.DRAFT,
-                "cannabis_metafields": product.cannabis_metafields.model_dump() if product.cannabis_metafields else None,
-                "ai_description_generated": False,
-                "synced_to_shopify": False,
-                "created_at": now,
-                "updated_at": now,
-            }
-
-            products_db[product_id] = product_data
-            created.append(product_data)
-        except Exception as e:
-            errors.append({"index": i, "error": str(e)})
+    return {"job_id": job.id, "status": "queued"}
 
-    return {
-        "created": len(created),
-        "errors": errors,
-        "products": created
-    }
+
+@router.get("/bulk-import/{job_id}", response_model=TaskResponse)
+async def get_bulk_import_job(
+    job_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get the status and result of a bulk import."""
+    job = tasks_db.get(job_id)
+    # Other users' jobs are reported as missing rather than forbidden
+    if (
+        job is None
+        or job.task_type != TaskType.BULK_IMPORT
+        or (job.metadata or {}).get("user_id") != current_user["id"]
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Import job not found"
+        )
+    return job
@@ -1,19 +1,77 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Query, Request
-from fastapi.responses import RedirectResponse
-from typing import Optional, Dict, Any, List
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Request, BackgroundTasks
+from fastapi.responses import ORJSONResponse, RedirectResponse
+from typing import Optional, Dict, Any, List, Set
+from collections import defaultdict
+from cachetools import TTLCache
 from datetime import datetime
+import asyncio
+import orjson
 import uuid
 import secrets
 
-from app.services.auth import get_current_user
+from app.services.auth import get_current_user, intern_value
+from app.models.product import ProductRecord
+from app.models.store import StoreRecord
+from app.models.task import TaskResponse, TaskStatus, TaskType
 from app.services.shopify import ShopifyService, get_shopify_service, store_connections
 from app.config import settings
+from app.responses import etag_response
 
 router = APIRouter(prefix="/shopify", tags=["Shopify Integration"])
 
 # In-memory store storage (will be replaced with Supabase)
-stores_db: Dict[str, Dict[str, Any]] = {}
-oauth_states: Dict[str, Dict[str, Any]] = {}
+stores_db: Dict[str, StoreRecord] = {}
+# Pending OAuth flows by state; abandoned flows expire instead of piling up
+OAUTH_STATE_TTL_SECONDS = 600
+OAUTH_STATE_MAX_SIZE = 10_000
+oauth_states: TTLCache = TTLCache(maxsize=OAUTH_STATE_MAX_SIZE, ttl=OAUTH_STATE_TTL_SECONDS)
+
+# Secondary index: user_id -> {store_id: store}, maintained by add_store/remove_store
+stores_by_user: Dict[str, Dict[str, StoreRecord]] = defaultdict(dict)
+# Ids of stores whose status is "connected"
+connected_store_ids: Set[str] = set()
+# Access tokens live apart from the rows so stores_db entries are safe to return as-is
+store_tokens: Dict[str, str] = {}
+# Dashboards poll the store endpoints; clients always revalidate (a store may
+# have just connected) but get a bodiless 304 while nothing has changed
+STORES_CACHE_CONTROL = "private, no-cache"
+# shopify_domain -> store_id, so OAuth callbacks find a reconnecting store without a scan
+stores_by_domain: Dict[str, str] = {}
+
+
+def add_store(store: StoreRecord, access_token: Optional[str] = None) -> None:
+    """Insert a store and index it by owner."""
+    if access_token:
+        store_tokens[store.id] = access_token
+    stores_db[store.id] = store
+    stores_by_user[store.user_id][store.id] = store
+    stores_by_domain[store.shopify_domain] = store.id
+    set_store_status(store, store.status)
+
+
+def set_store_status(store: StoreRecord, store_status: str) -> None:
+    """Update a store's status and the connected-store index."""
+    store.status = store_status = intern_value(store_status)
+    if store_status == "connected":
+        connected_store_ids.add(store.id)
+    else:
+        connected_store_ids.discard(store.id)
+
+
+def remove_store(store_id: str) -> Optional[StoreRecord]:
+    """Remove a store and drop it from the owner index."""
+    store = stores_db.pop(store_id, None)
+    store_tokens.pop(store_id, None)
+    connected_store_ids.discard(store_id)
+    if store is not None:
+        if stores_by_domain.get(store.shopify_domain) == store_id:
+            del stores_by_domain[store.shopify_domain]
+        user_stores = stores_by_user.get(store.user_id)
+        if user_stores is not None:
+            user_stores.pop(store_id, None)
+            if not user_stores:
+                del stores_by_user[store.user_id]
+    return store
 
 
 @router.get("/auth/install")
@@ -25,6 +83,16 @@ async def install_app(
     if not shop.endswith(".myshopify.com"):
         shop = f"{shop}.myshopify.com"
 
+    # Reinstalling a store this user already has connected needs no OAuth round trip
+    existing = stores_db.get(stores_by_domain.get(shop))
+    if (
+        existing is not None
+        and existing.user_id == current_user["id"]
+        and existing.id in connected_store_ids
+        and existing.id in store_tokens
+    ):
+        return {"auth_url": None, "already_connected": True, "store_id": existing.id}
+
     # Generate state for CSRF protection
     state = secrets.token_urlsafe(32)
     oauth_states[state] = {
@@ -50,14 +118,14 @@ async def oauth_callback(
     hmac: Optional[str] = None
 ):
     """Handle Shopify OAuth callback."""
-    # Verify state
-    if state not in oauth_states:
+    # Verify state; each state is single-use and expires with the flow
+    oauth_data = oauth_states.pop(state, None)
+    if oauth_data is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid state parameter"
         )
 
-    oauth_data = oauth_states.pop(state)
     user_id = oauth_data["user_id"]
 
     # Exchange code for access token
@@ -72,42 +140,31 @@ async def oauth_callback(
         )
 
     # Create or update store record
-    store_id = str(uuid.uuid4())
     now = datetime.utcnow().isoformat()
 
     # Check if store already exists
-    existing_store = None
-    for sid, store in stores_db.items():
-        if store["shopify_domain"] == shop:
-            existing_store = sid
-            break
+    existing_store = stores_by_domain.get(shop)
 
     if existing_store:
-        stores_db[existing_store]["shopify_access_token"] = access_token
-        stores_db[existing_store]["status"] = "connected"
-        stores_db[existing_store]["updated_at"] = now
-        store_id = existing_store
+        store_tokens[existing_store] = access_token
+        set_store_status(stores_db[existing_store], "connected")
+        stores_db[existing_store].updated_at = now
     else:
         # Get shop info
         shopify.access_token = access_token
         shop_info = await shopify.get_shop()
         shop_data = shop_info.get("shop", {})
 
-        stores_db[store_id] = {
-            "id": store_id,
-            "user_id": user_id,
-            "name": shop_data.get("name", shop),
-            "shopify_domain": shop,
-            "shopify_access_token": access_token,
-            "status": "connected",
-            "industry": None,
-            "brand_colors": None,
-            "logo_url": None,
-            "products_count": shop_data.get("products_count", 0),
-            "last_synced": None,
-            "created_at": now,
-            "updated_at": now,
-        }
+        add_store(StoreRecord(
+            id=str(uuid.uuid4()),
+            user_id=user_id,
+            name=shop_data.get("name", shop),
+            shopify_domain=shop,
+            status="connected",
+            products_count=shop_data.get("products_count", 0),
+            created_at=now,
+            updated_at=now,
+        ), access_token)
 
     # Store connection for future use
     store_connections[shop] = ShopifyService(shop, access_token)
@@ -118,20 +175,18 @@ async def oauth_callback(
 
 @router.get("/stores")
 async def get_stores(
+    request: Request,
     current_user: dict = Depends(get_current_user)
 ):
     """Get all connected stores for the current user."""
-    user_stores = [
-        {k: v for k, v in store.items() if k != "shopify_access_token"}
-        for store in stores_db.values()
-        if store.get("user_id") == current_user["id"]
-    ]
-    return user_stores
+    body = orjson.dumps(list(stores_by_user.get(current_user["id"], {}).values()))
+    return etag_response(request, body, cache_control=STORES_CACHE_CONTROL)
 
 
 @router.get("/stores/{store_id}")
 async def get_store(
     store_id: str,
+    request: Request,
     current_user: dict = Depends(get_current_user)
 ):
     """Get a specific store."""
@@ -142,13 +197,13 @@ async def get_store(
         )
 
     store = stores_db[store_id]
-    if store.get("user_id") != current_user["id"]:
+    if store.user_id != current_user["id"]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Access denied"
         )
 
-    return {k: v for k, v in store.items() if k != "shopify_access_token"}
+    return etag_response(request, orjson.dumps(store), cache_control=STORES_CACHE_CONTROL)
 
 
 @router.delete("/stores/{store_id}")
@@ -164,18 +219,17 @@ async def disconnect_store(
         )
 
     store = stores_db[store_id]
-    if store.get("user_id") != current_user["id"]:
+    if store.user_id != current_user["id"]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Access denied"
         )
 
     # Remove from connections
-    shop_domain = store.get("shopify_domain")
-    if shop_domain in store_connections:
-        del store_connections[shop_domain]
+    shop_domain = store.shopify_domain
+    store_connections.pop(shop_domain, None)
 
-    del stores_db[store_id]
+    remove_store(store_id)
     return {"message": "Store disconnected successfully"}
 
 
@@ -194,14 +248,14 @@ async def get_store_products(
         )
 
     store = stores_db[store_id]
-    if store.get("user_id") != current_user["id"]:
+    if store.user_id != current_user["id"]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Access denied"
         )
 
-    shop_domain = store.get("shopify_domain")
-    access_token = store.get("shopify_access_token")
+    shop_domain = store.shopify_domain
+    access_token = store_tokens.get(store_id)
 
     if not access_token:
         raise HTTPException(
@@ -212,16 +266,126 @@ async def get_store_products(
     shopify = get_shopify_service(shop_domain, access_token)
     products = await shopify.get_products(limit, page_info)
 
-    return products
+    # Shopify's payload is plain JSON already; skip the jsonable_encoder walk over it
+    return ORJSONResponse(products)
+
+
+# Products upserted between yields to the event loop during a sync
+SYNC_YIELD_EVERY = 100
+
+
+def _product_from_shopify(
+    sp: Dict[str, Any],
+    store_id: str,
+    existing: Optional[ProductRecord],
+    now: str,
+) -> ProductRecord:
+    """Build the product row for a Shopify product, keeping the id of an existing row."""
+    variant = sp["variants"][0] if sp.get("variants") else {}
+    tags = sp.get("tags")
+    return ProductRecord(
+        id=existing.id if existing else str(uuid.uuid4()),
+        store_id=store_id,
+        shopify_product_id=str(sp["id"]),
+        title=sp.get("title") or "",
+        description=sp.get("body_html") or "",
+        price=float(variant.get("price") or 0),
+        compare_at_price=float(variant.get("compare_at_price") or 0),
+        sku=variant.get("sku"),
+        barcode=variant.get("barcode"),
+        inventory_quantity=variant.get("inventory_quantity") or 0,
+        images=[img.get("src") for img in sp.get("images") or ()],
+        tags=tags.split(", ") if tags else [],
+        product_type=sp.get("product_type"),
+        vendor=sp.get("vendor"),
+        status="active" if sp.get("status") == "active" else "draft",
+        cannabis_metafields=None,
+        ai_description_generated=False,
+        synced_to_shopify=True,
+        created_at=existing.created_at if existing else now,
+        updated_at=now,
+    )
+
+
+def _shopify_product_payload(product: ProductRecord) -> Dict[str, Any]:
+    """Shopify product body for a local product, leaving out fields that aren't set."""
+    variant = {
+        "price": str(product.price),
+        "compare_at_price": str(product.compare_at_price) if product.compare_at_price else None,
+        "sku": product.sku,
+        "barcode": product.barcode,
+        "inventory_quantity": product.inventory_quantity,
+    }
+    payload = {
+        "title": product.title,
+        "body_html": product.description,
+        "vendor": product.vendor,
+        "product_type": product.product_type,
+        "tags": ", ".join(product.tags),
+    }
+    payload = {key: value for key, value in payload.items() if value is not None}
+    # On updates an explicit null is what clears a sale price on Shopify's side
+    payload["variants"] = [{
+        key: value for key, value in variant.items()
+        if value is not None or (key == "compare_at_price" and product.shopify_product_id)
+    }]
+    if product.images:
+        payload["images"] = [{"src": url} for url in product.images]
+    return payload
+
+
+async def _run_product_sync(job, store_id: str, shopify: ShopifyService) -> None:
+    """Sync a store's products in the background and record the outcome on the job."""
+    from app.routers.products import products_db, products_by_shopify_id, add_product
+    from app.routers.tasks import set_task_status
+
+    set_task_status(job, TaskStatus.IN_PROGRESS)
+    synced = 0
+    errors = []
+
+    try:
+        # One bulk operation instead of paging through the REST products endpoint
+        now = datetime.utcnow().isoformat()
+        i = 0
+        async for sp in shopify.bulk_export_products():
+            try:
+                # Find existing product by Shopify ID
+                existing = products_db.get(products_by_shopify_id.get(str(sp["id"])))
+                add_product(_product_from_shopify(sp, store_id, existing, now))
+                synced += 1
+            except Exception as e:
+                errors.append({"product_id": sp.get("id"), "error": str(e)})
+
+            # Upserts are in-memory, so yield now and then to keep other requests moving
+            i += 1
+            if i % SYNC_YIELD_EVERY == 0:
+                await asyncio.sleep(0)
+    except Exception as e:
+        set_task_status(job, TaskStatus.FAILED, {"error": f"Sync failed: {str(e)}", "synced": synced})
+        return
+
+    # The store may have been disconnected while the sync ran
+    store = stores_db.get(store_id)
+    last_synced = datetime.utcnow().isoformat()
+    if store is not None:
+        store.last_synced = last_synced
+        store.products_count = synced
+
+    set_task_status(job, TaskStatus.COMPLETED, {
+        "synced": synced,
+        "errors": errors,
+        "last_synced": last_synced,
+    })
 
 
-@router.post("/stores/{store_id}/sync")
+@router.post("/stores/{store_id}/sync", status_code=status.HTTP_202_ACCEPTED)
 async def sync_store_products(
     store_id: str,
+    background_tasks: BackgroundTasks,
     current_user: dict = Depends(get_current_user)
 ):
-    """Sync products from Shopify to local database."""
-    from app.routers.products import products_db
+    """Queue a product sync from Shopify; poll /shopify/stores/{store_id}/sync/{job_id} for the result."""
+    from app.routers.tasks import create_job
 
     if store_id not in stores_db:
         raise HTTPException(
@@ -230,14 +394,14 @@ async def sync_store_products(
         )
 
     store = stores_db[store_id]
-    if store.get("user_id") != current_user["id"]:
+    if store.user_id != current_user["id"]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Access denied"
         )
 
-    shop_domain = store.get("shopify_domain")
-    access_token = store.get("shopify_access_token")
+    shop_domain = store.shopify_domain
+    access_token = store_tokens.get(store_id)
 
     if not access_token:
         raise HTTPException(
@@ -247,69 +411,47 @@ async def sync_store_products(
 
     shopify = get_shopify_service(shop_domain, access_token)
 
-    synced = 0
-    errors = []
+    job = create_job(
+        store_id=store_id,
+        task_type=TaskType.PRODUCT_SYNC,
+        title=f"Sync products from {shop_domain}",
+        metadata={"user_id": current_user["id"]},
+    )
+    background_tasks.add_task(_run_product_sync, job, store_id, shopify)
 
-    try:
-        products_response = await shopify.get_products(limit=250)
-        shopify_products = products_response.get("products", [])
+    return {"job_id": job.id, "status": "queued"}
 
-        for sp in shopify_products:
-            try:
-                product_id = str(uuid.uuid4())
-                now = datetime.utcnow().isoformat()
 
-                # Find existing product by Shopify ID
-                existing_id = None
-                for pid, prod in products_db.items():
-                    if prod.get("shopify_product_id") == str(sp["id"]):
-                        existing_id = pid
-                        break
-
-                product_data = {
-                    "id": existing_id or product_id,
-                    "store_id": store_id,
-                    "shopify_product_id": str(sp["id"]),
-                    "title": sp.get("title", ""),
-                    "description": sp.get("body_html", ""),
-                    "price": float(sp.get("variants", [{}])[0].get("price", 0)),
-                    "compare_at_price": float(sp.get("variants", [{}])[0].get("compare_at_price", 0) or 0),
-                    "sku": sp.get("variants", [{}])[0].get("sku"),
-                    "barcode": sp.get("variants", [{}])[0].get("barcode"),
-                    "inventory_quantity": sp.get("variants", [{}])[0].get("inventory_quantity", 0),
-                    "images": [img.get("src") for img in sp.get("images", [])],
-                    "tags": sp.get("tags", "").split(", ") if sp.get("tags") else [],
-                    "product_type": sp.get("product_type"),
-                    "vendor": sp.get("vendor"),
-                    "status": "active" if sp.get("status") == "active" else "draft",
-                    "cannabis_metafields": None,
-                    "ai_description_generated": False,
-                    "synced_to_shopify": True,
-                    "created_at": existing_id and products_db.get(existing_id, {}).get("created_at") or now,
-                    "updated_at": now,
-                }
-
-                products_db[existing_id or product_id] = product_data
-                synced += 1
-
-            except Exception as e:
-                errors.append({"product_id": sp.get("id"), "error": str(e)})
-
-        # Update store sync time
-        stores_db[store_id]["last_synced"] = datetime.utcnow().isoformat()
-        stores_db[store_id]["products_count"] = synced
+@router.get("/stores/{store_id}/sync/{job_id}", response_model=TaskResponse)
+async def get_sync_job(
+    store_id: str,
+    job_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get the status and result of a product sync."""
+    from app.routers.tasks import tasks_db
 
-    except Exception as e:
+    store = stores_db.get(store_id)
+    if store is not None and store.user_id != current_user["id"]:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Sync failed: {str(e)}"
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Access denied"
         )
 
-    return {
-        "synced": synced,
-        "errors": errors,
-        "last_synced": stores_db[store_id]["last_synced"]
-    }
+    job = tasks_db.get(job_id)
+    # Checked on the job itself too, since the store may have been removed;
+    # other users' jobs are reported as missing rather than forbidden
+    if (
+        job is None
+        or job.task_type != TaskType.PRODUCT_SYNC
+        or job.store_id != store_id
+        or (job.metadata or {}).get("user_id") != current_user["id"]
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Sync job not found"
+        )
+    return job
 
 
 @router.post("/stores/{store_id}/export/{product_id}")
@@ -319,7 +461,7 @@ async def export_product_to_shopify(
     current_user: dict = Depends(get_current_user)
 ):
     """Export a local product to Shopify."""
-    from app.routers.products import products_db
+    from app.routers.products import products_db, link_shopify_product
 
     if store_id not in stores_db:
         raise HTTPException(
@@ -336,52 +478,34 @@ async def export_product_to_shopify(
     store = stores_db[store_id]
     product = products_db[product_id]
 
-    if store.get("user_id") != current_user["id"]:
+    if store.user_id != current_user["id"]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Access denied"
         )
 
-    shop_domain = store.get("shopify_domain")
-    access_token = store.get("shopify_access_token")
+    shop_domain = store.shopify_domain
+    access_token = store_tokens.get(store_id)
 
     shopify = get_shopify_service(shop_domain, access_token)
 
-    # Build Shopify product data
-    shopify_product = {
-        "title": product["title"],
-        "body_html": product.get("description", ""),
-        "vendor": product.get("vendor", ""),
-        "product_type": product.get("product_type", ""),
-        "tags": ", ".join(product.get("tags", [])),
-        "variants": [{
-            "price": str(product["price"]),
-            "compare_at_price": str(product.get("compare_at_price", "")) if product.get("compare_at_price") else None,
-            "sku": product.get("sku", ""),
-            "barcode": product.get("barcode", ""),
-            "inventory_quantity": product.get("inventory_quantity", 0),
-        }],
-    }
-
-    # Add images if present
-    if product.get("images"):
-        shopify_product["images"] = [{"src": url} for url in product["images"]]
+    shopify_product = _shopify_product_payload(product)
 
     try:
-        if product.get("shopify_product_id"):
+        if product.shopify_product_id:
             # Update existing
-            result = await shopify.update_product(product["shopify_product_id"], shopify_product)
+            result = await shopify.update_product(product.shopify_product_id, shopify_product)
         else:
             # Create new
             result = await shopify.create_product(shopify_product)
-            products_db[product_id]["shopify_product_id"] = str(result["product"]["id"])
+            link_shopify_product(product, str(result["product"]["id"]))
 
-        products_db[product_id]["synced_to_shopify"] = True
-        products_db[product_id]["updated_at"] = datetime.utcnow().isoformat()
+        product.synced_to_shopify = True
+        product.updated_at = datetime.utcnow().isoformat()
 
         return {
             "success": True,
-            "shopify_product_id": products_db[product_id]["shopify_product_id"]
+            "shopify_product_id": product.shopify_product_id
         }
 
     except Exception as e:
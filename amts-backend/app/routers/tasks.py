@@ -1,9 +1,13 @@
-from fastapi import APIRouter, HTTPException, status, Depends, Query
-from typing import Optional, List, Dict, Any
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Request
+from typing import Optional, List, Dict, Any, Set
+from collections import Counter, defaultdict
 from datetime import datetime
+import heapq
+import orjson
 import uuid
 
 from app.services.auth import get_current_user
+from app.responses import etag_response
 from app.models.task import (
     TaskCreate,
     TaskUpdate,
@@ -11,15 +15,119 @@ from app.models.task import (
     TaskStatus,
     TaskPriority,
     TaskType,
+    TaskRecord,
 )
 
 router = APIRouter(prefix="/tasks", tags=["Tasks"])
 
 # In-memory task storage (will be replaced with Supabase)
-tasks_db: Dict[str, Dict[str, Any]] = {}
+tasks_db: Dict[str, TaskRecord] = {}
+
+# Secondary index: store_id -> {task_id: task}, maintained by add_task/remove_task
+tasks_by_store: Dict[str, Dict[str, TaskRecord]] = defaultdict(dict)
+# Ids of tasks currently in the pending state
+pending_task_ids: Set[str] = set()
+# Running stats counters per store_id (None for all stores): "total" plus
+# ("status" | "priority" | "task_type", value) buckets
+task_counts: Dict[Optional[str], Counter] = defaultdict(Counter)
+
+
+def add_task(task: TaskRecord) -> None:
+    """Insert a task and index it by store."""
+    tasks_db[task.id] = task
+    tasks_by_store[task.store_id][task.id] = task
+    _index_task_status(task)
+    _count_task(task, 1)
+
+
+def _index_task_status(task: TaskRecord) -> None:
+    """Keep pending_task_ids in sync after a task's status is written."""
+    if task.status == TaskStatus.PENDING:
+        pending_task_ids.add(task.id)
+    else:
+        pending_task_ids.discard(task.id)
+
+
+def _count_task(task: TaskRecord, delta: int) -> None:
+    """Add (1) or withdraw (-1) a task's current field values from task_counts."""
+    for key in (None, task.store_id):
+        counts = task_counts[key]
+        counts["total"] += delta
+        counts[("status", task.status)] += delta
+        counts[("priority", task.priority)] += delta
+        counts[("task_type", task.task_type)] += delta
+        if not counts["total"]:
+            del task_counts[key]
+
+
+def remove_task(task_id: str) -> Optional[TaskRecord]:
+    """Remove a task and drop it from the store index."""
+    task = tasks_db.pop(task_id, None)
+    pending_task_ids.discard(task_id)
+    if task is not None:
+        _count_task(task, -1)
+        store_tasks = tasks_by_store.get(task.store_id)
+        if store_tasks is not None:
+            store_tasks.pop(task_id, None)
+            if not store_tasks:
+                del tasks_by_store[task.store_id]
+    return task
+
+
+# Stats change on every task write, so clients revalidate each poll and get a
+# bodiless 304 while the counts are unchanged
+TASK_STATS_CACHE_CONTROL = "private, no-cache"
+
+# Sort rank per priority, urgent first; unknown priorities rank as medium
+_PRIORITY_ORDER = {"urgent": 0, "high": 1, "medium": 2, "low": 3}
+
+
+def _task_sort_key(task: TaskRecord):
+    return (_PRIORITY_ORDER.get(task.priority, 2), task.created_at)
+
+
+def create_job(
+    store_id: str,
+    task_type: TaskType,
+    title: str,
+    metadata: Optional[Dict[str, Any]] = None,
+) -> TaskRecord:
+    """Record a pending task for work that runs after the response is sent."""
+    now = datetime.utcnow().isoformat()
+    task = TaskRecord(
+        id=str(uuid.uuid4()),
+        store_id=store_id,
+        title=title,
+        task_type=task_type,
+        metadata=metadata,
+        created_at=now,
+        updated_at=now,
+    )
+    add_task(task)
+    return task
 
 
-@router.get("", response_model=List[TaskResponse])
+def set_task_status(
+    task: TaskRecord,
+    task_status: TaskStatus,
+    result: Optional[Dict[str, Any]] = None,
+) -> None:
+    """Move a task to a new status, stamping start/finish times and the result."""
+    now = datetime.utcnow().isoformat()
+    _count_task(task, -1)
+    task.status = task_status
+    _index_task_status(task)
+    _count_task(task, 1)
+    if task_status == TaskStatus.IN_PROGRESS and not task.started_at:
+        task.started_at = now
+    elif task_status in (TaskStatus.COMPLETED, TaskStatus.FAILED):
+        task.completed_at = now
+    if result is not None:
+        task.result = result
+    task.updated_at = now
+
+
+@router.get("", response_model=List[TaskResponse], response_model_exclude_none=True)
 async def get_tasks(
     store_id: Optional[str] = None,
     status: Optional[TaskStatus] = None,
@@ -30,25 +138,19 @@ async def get_tasks(
     current_user: dict = Depends(get_current_user)
 ):
     """Get all tasks."""
-    tasks = list(tasks_db.values())
-
-    if store_id:
-        tasks = [t for t in tasks if t.get("store_id") == store_id]
-    if status:
-        tasks = [t for t in tasks if t.get("status") == status]
-    if priority:
-        tasks = [t for t in tasks if t.get("priority") == priority]
-    if task_type:
-        tasks = [t for t in tasks if t.get("task_type") == task_type]
+    tasks = tasks_by_store.get(store_id, {}).values() if store_id else tasks_db.values()
 
-    # Sort by priority (urgent first) then by created_at
-    priority_order = {"urgent": 0, "high": 1, "medium": 2, "low": 3}
-    tasks.sort(key=lambda x: (priority_order.get(x.get("priority", "medium"), 2), x.get("created_at", "")))
+    # One pass with every filter, rather than one list per filter
+    tasks = (
+        t for t in tasks
+        if (not status or t.status == status)
+        and (not priority or t.priority == priority)
+        and (not task_type or t.task_type == task_type)
+    )
 
-    total = len(tasks)
-    tasks = tasks[offset:offset + limit]
-
-    return tasks
+    # Only the first offset + limit by priority (urgent first) then created_at
+    # are needed, so keep a bounded heap instead of sorting every match
+    return heapq.nsmallest(offset + limit, tasks, key=_task_sort_key)[offset:]
 
 
 @router.get("/{task_id}", response_model=TaskResponse)
@@ -74,24 +176,21 @@ async def create_task(
     task_id = str(uuid.uuid4())
     now = datetime.utcnow().isoformat()
 
-    task_data = {
-        "id": task_id,
-        "store_id": task.store_id,
-        "product_id": task.product_id,
-        "title": task.title,
-        "description": task.description,
-        "task_type": task.task_type,
-        "priority": task.priority,
-        "status": TaskStatus.PENDING,
-        "metadata": task.metadata,
-        "result": None,
-        "started_at": None,
-        "completed_at": None,
-        "created_at": now,
-        "updated_at": now,
-    }
-
-    tasks_db[task_id] = task_data
+    task_data = TaskRecord(
+        id=task_id,
+        store_id=task.store_id,
+        product_id=task.product_id,
+        title=task.title,
+        description=task.description,
+        task_type=task.task_type,
+        priority=task.priority,
+        status=TaskStatus.PENDING,
+        metadata=task.metadata,
+        created_at=now,
+        updated_at=now,
+    )
+
+    add_task(task_data)
     return task_data
 
 
@@ -111,18 +210,21 @@ async def update_task(
     task = tasks_db[task_id]
     update_data = updates.model_dump(exclude_unset=True)
 
+    _count_task(task, -1)
     for field, value in update_data.items():
-        task[field] = value
+        setattr(task, field, value)
+    _index_task_status(task)
+    _count_task(task, 1)
 
     # Handle status transitions
+    now = datetime.utcnow().isoformat()
     if "status" in update_data:
-        if update_data["status"] == TaskStatus.IN_PROGRESS and not task.get("started_at"):
-            task["started_at"] = datetime.utcnow().isoformat()
+        if update_data["status"] == TaskStatus.IN_PROGRESS and not task.started_at:
+            task.started_at = now
         elif update_data["status"] == TaskStatus.COMPLETED:
-            task["completed_at"] = datetime.utcnow().isoformat()
+            task.completed_at = now
 
-    task["updated_at"] = datetime.utcnow().isoformat()
-    tasks_db[task_id] = task
+    task.updated_at = now
 
     return task
 
@@ -139,7 +241,7 @@ async def delete_task(
             detail="Task not found"
         )
 
-    del tasks_db[task_id]
+    remove_task(task_id)
     return {"message": "Task deleted successfully"}
 
 
@@ -156,9 +258,11 @@ async def start_task(
         )
 
     task = tasks_db[task_id]
-    task["status"] = TaskStatus.IN_PROGRESS
-    task["started_at"] = datetime.utcnow().isoformat()
-    task["updated_at"] = datetime.utcnow().isoformat()
+    _count_task(task, -1)
+    task.status = TaskStatus.IN_PROGRESS
+    _index_task_status(task)
+    _count_task(task, 1)
+    task.started_at = task.updated_at = datetime.utcnow().isoformat()
 
     return task
 
@@ -177,42 +281,43 @@ async def complete_task(
         )
 
     task = tasks_db[task_id]
-    task["status"] = TaskStatus.COMPLETED
-    task["completed_at"] = datetime.utcnow().isoformat()
-    task["updated_at"] = datetime.utcnow().isoformat()
+    _count_task(task, -1)
+    task.status = TaskStatus.COMPLETED
+    _index_task_status(task)
+    _count_task(task, 1)
+    task.completed_at = task.updated_at = datetime.utcnow().isoformat()
     if result:
-        task["result"] = result
+        task.result = result
 
     return task
 
 
 @router.get("/stats/summary")
 async def get_task_stats(
+    request: Request,
     store_id: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
     """Get task statistics."""
-    tasks = list(tasks_db.values())
-
-    if store_id:
-        tasks = [t for t in tasks if t.get("store_id") == store_id]
+    # Counters are kept current on every write, so this doesn't touch the tasks
+    counts = task_counts.get(store_id or None) or Counter()
 
     stats = {
-        "total": len(tasks),
-        "pending": len([t for t in tasks if t.get("status") == TaskStatus.PENDING]),
-        "in_progress": len([t for t in tasks if t.get("status") == TaskStatus.IN_PROGRESS]),
-        "completed": len([t for t in tasks if t.get("status") == TaskStatus.COMPLETED]),
-        "failed": len([t for t in tasks if t.get("status") == TaskStatus.FAILED]),
+        "total": counts["total"],
+        "pending": counts[("status", TaskStatus.PENDING)],
+        "in_progress": counts[("status", TaskStatus.IN_PROGRESS)],
+        "completed": counts[("status", TaskStatus.COMPLETED)],
+        "failed": counts[("status", TaskStatus.FAILED)],
         "by_priority": {
-            "urgent": len([t for t in tasks if t.get("priority") == TaskPriority.URGENT]),
-            "high": len([t for t in tasks if t.get("priority") == TaskPriority.HIGH]),
-            "medium": len([t for t in tasks if t.get("priority") == TaskPriority.MEDIUM]),
-            "low": len([t for t in tasks if t.get("priority") == TaskPriority.LOW]),
+            "urgent": counts[("priority", TaskPriority.URGENT)],
+            "high": counts[("priority", TaskPriority.HIGH)],
+            "medium": counts[("priority", TaskPriority.MEDIUM)],
+            "low": counts[("priority", TaskPriority.LOW)],
+        },
+        "by_type": {
+            task_type.value: counts[("task_type", task_type)]
+            for task_type in TaskType
         },
-        "by_type": {}
     }
 
-    for task_type in TaskType:
-        stats["by_type"][task_type.value] = len([t for t in tasks if t.get("task_type") == task_type])
-
-    return stats
+    return etag_response(request, orjson.dumps(stats), cache_control=TASK_STATS_CACHE_CONTROL)
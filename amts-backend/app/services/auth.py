@@ -1,10 +1,14 @@
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
-from jose import JWTError, jwt
+from typing import Optional, Dict, Any, Set, Iterator
+import jwt
+from cachetools import TTLCache
 from fastapi import HTTPException, status, Depends
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import uuid
-import hashlib
+import bcrypt
+import sys
+import time
 
 from app.config import settings
 
@@ -17,7 +21,75 @@ ROLE_SUPER_ADMIN = "super_admin"
 
 # In-memory user storage (will be replaced with Supabase)
 users_db: Dict[str, Dict[str, Any]] = {}
-refresh_tokens_db: Dict[str, str] = {}
+# Latest refresh token per user, dropped once it would have expired anyway
+REFRESH_TOKEN_CACHE_MAX_SIZE = 100_000
+refresh_tokens_db: TTLCache = TTLCache(
+    maxsize=REFRESH_TOKEN_CACHE_MAX_SIZE,
+    ttl=settings.refresh_token_expire_days * 86400,
+)
+
+# bcrypt work factor; each step doubles the cost of a hash
+BCRYPT_ROUNDS = 12
+
+# Fields update_user may change
+_UPDATABLE_USER_FIELDS = frozenset((
+    "full_name", "company_name", "industry", "avatar_url",
+    "subscription_tier", "onboarding_completed", "is_active", "role",
+))
+
+# Signing key and algorithm, resolved once rather than per token
+_JWT_KEY = settings.jwt_secret_key.encode()
+_JWT_ALGORITHM = settings.jwt_algorithm
+_JWT_ALGORITHMS = [_JWT_ALGORITHM]
+
+# Verified access-token payloads, reused for up to TOKEN_CACHE_TTL_SECONDS
+# (and never past the token's own exp)
+TOKEN_CACHE_MAX_SIZE = 50_000
+TOKEN_CACHE_TTL_SECONDS = 60
+# Tokens this close to expiry aren't worth caching
+TOKEN_CACHE_MIN_REMAINING_SECONDS = 5
+_decoded_tokens: TTLCache = TTLCache(maxsize=TOKEN_CACHE_MAX_SIZE, ttl=TOKEN_CACHE_TTL_SECONDS)
+
+# token -> (user, user version, exp) for the users resolved by get_current_user,
+# valid while the user's version is unchanged
+USER_CACHE_MAX_SIZE = 10_000
+USER_CACHE_TTL_SECONDS = 30
+_resolved_users: TTLCache = TTLCache(maxsize=USER_CACHE_MAX_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+# Bumped on every write to a user, so cached resolutions go stale at once
+user_versions: Dict[str, int] = {}
+
+# Password hashes live apart from the rows so users_db entries are safe to return as-is
+password_hashes: Dict[str, str] = {}
+# email -> user_id for login and duplicate checks
+users_by_email: Dict[str, str] = {}
+# Lowercased "email\0full_name\0company_name" per user for admin client search
+users_search_index: Dict[str, str] = {}
+# Ids of users with is_active set, so dashboards can count without a scan
+active_user_ids: Set[str] = set()
+
+
+def intern_value(value: Any) -> Any:
+    """Intern plain string values so repeated equality checks hit the identity fast path."""
+    return sys.intern(value) if type(value) is str else value
+
+
+def _bump_user_version(user_id: str) -> None:
+    user_versions[user_id] = user_versions.get(user_id, 0) + 1
+
+
+def index_user(user: Dict[str, Any]) -> None:
+    """Refresh the secondary indexes for a user after it is written."""
+    _bump_user_version(user["id"])
+    users_by_email[user["email"]] = user["id"]
+    users_search_index[user["id"]] = "\0".join((
+        user.get("email") or "",
+        user.get("full_name") or "",
+        user.get("company_name") or "",
+    )).lower()
+    if user.get("is_active", True):
+        active_user_ids.add(user["id"])
+    else:
+        active_user_ids.discard(user["id"])
 
 
 def init_admin_user():
@@ -25,14 +97,14 @@ def init_admin_user():
     admin_email = "ben@advancedmarketing.com"
 
     # Check if admin already exists
-    if any(u["email"] == admin_email for u in users_db.values()):
+    if admin_email in users_by_email:
         return
 
     admin_id = str(uuid.uuid4())
+    now = datetime.utcnow().isoformat()
     admin_user = {
         "id": admin_id,
         "email": admin_email,
-        "hashed_password": get_password_hash("JEsus777$$!"),  # From CLAUDE.md
         "full_name": "Ben",
         "company_name": "Advanced Marketing",
         "industry": "cannabis",
@@ -41,22 +113,32 @@ def init_admin_user():
         "subscription_tier": "enterprise",
         "onboarding_completed": True,
         "is_active": True,
-        "created_at": datetime.utcnow().isoformat(),
-        "updated_at": datetime.utcnow().isoformat(),
+        "created_at": now,
+        "updated_at": now,
     }
     users_db[admin_id] = admin_user
+    password_hashes[admin_id] = get_password_hash("JEsus777$$!")  # From CLAUDE.md
+    index_user(admin_user)
     print(f"Admin user created: {admin_email}")
 
 
+def _password_bytes(password: str) -> bytes:
+    # bcrypt only reads the first 72 bytes, and bcrypt 5 rejects anything longer
+    return password.encode()[:72]
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify password using SHA256 (simple implementation for development)."""
-    return get_password_hash(plain_password) == hashed_password
+    """Verify a password against its bcrypt hash."""
+    try:
+        return bcrypt.checkpw(_password_bytes(plain_password), hashed_password.encode())
+    except ValueError:
+        # Not a bcrypt hash
+        return False
 
 
 def get_password_hash(password: str) -> str:
-    """Hash password using SHA256 (simple implementation for development)."""
-    # In production, use bcrypt/argon2 with proper configuration
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Hash a password with bcrypt and a per-password salt."""
+    return bcrypt.hashpw(_password_bytes(password), bcrypt.gensalt(BCRYPT_ROUNDS)).decode()
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -66,32 +148,52 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     else:
         expire = datetime.utcnow() + timedelta(minutes=settings.access_token_expire_minutes)
     to_encode.update({"exp": expire, "type": "access"})
-    encoded_jwt = jwt.encode(to_encode, settings.jwt_secret_key, algorithm=settings.jwt_algorithm)
+    encoded_jwt = jwt.encode(to_encode, _JWT_KEY, algorithm=_JWT_ALGORITHM)
     return encoded_jwt
 
 
 def create_refresh_token(user_id: str) -> str:
     expire = datetime.utcnow() + timedelta(days=settings.refresh_token_expire_days)
     to_encode = {"sub": user_id, "exp": expire, "type": "refresh"}
-    encoded_jwt = jwt.encode(to_encode, settings.jwt_secret_key, algorithm=settings.jwt_algorithm)
+    encoded_jwt = jwt.encode(to_encode, _JWT_KEY, algorithm=_JWT_ALGORITHM)
     refresh_tokens_db[user_id] = encoded_jwt
     return encoded_jwt
 
 
 def decode_token(token: str) -> Dict[str, Any]:
+    payload = _decoded_tokens.get(token)
+    if payload is not None:
+        if payload["exp"] > time.time():
+            return payload
+        _decoded_tokens.pop(token, None)
+
     try:
-        payload = jwt.decode(token, settings.jwt_secret_key, algorithms=[settings.jwt_algorithm])
-        return payload
-    except JWTError:
+        payload = jwt.decode(token, _JWT_KEY, algorithms=_JWT_ALGORITHMS, options={"require": ["exp", "sub"]})
+    except jwt.InvalidTokenError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid token",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    # Refresh tokens are only presented once, so only access tokens are cached
+    if (
+        payload.get("type") == "access"
+        and payload.get("exp", 0) - time.time() > TOKEN_CACHE_MIN_REMAINING_SECONDS
+    ):
+        _decoded_tokens[token] = payload
+    return payload
+
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Dict[str, Any]:
     token = credentials.credentials
+    cached = _resolved_users.get(token)
+    if cached is not None:
+        user, version, exp = cached
+        if version == user_versions.get(user["id"]) and exp > time.time():
+            return user
+        _resolved_users.pop(token, None)
+
     payload = decode_token(token)
 
     if payload.get("type") != "access":
@@ -116,6 +218,8 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             detail="User account is disabled",
         )
 
+    if payload["exp"] - time.time() > TOKEN_CACHE_MIN_REMAINING_SECONDS:
+        _resolved_users[token] = (user, user_versions.get(user_id), payload["exp"])
     return user
 
 
@@ -140,7 +244,15 @@ async def get_super_admin_user(current_user: Dict[str, Any] = Depends(get_curren
     return current_user
 
 
-def create_user(
+def _check_email_available(email: str) -> None:
+    if email in users_by_email:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered",
+        )
+
+
+async def create_user(
     email: str,
     password: str,
     full_name: Optional[str] = None,
@@ -149,58 +261,51 @@ def create_user(
     company_name: Optional[str] = None,
     industry: Optional[str] = None,
 ) -> Dict[str, Any]:
-    if any(u["email"] == email for u in users_db.values()):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Email already registered",
-        )
+    _check_email_available(email)
+    # bcrypt takes ~250ms, so hash in the threadpool rather than on the loop;
+    # the email is checked again after since another signup may have taken it
+    hashed_password = await run_in_threadpool(get_password_hash, password)
+    _check_email_available(email)
 
     user_id = str(uuid.uuid4())
-    hashed_password = get_password_hash(password)
+    now = datetime.utcnow().isoformat()
 
     user = {
         "id": user_id,
         "email": email,
-        "hashed_password": hashed_password,
         "full_name": full_name,
         "company_name": company_name,
         "industry": industry,
         "avatar_url": None,
-        "role": role,
-        "subscription_tier": subscription_tier,
+        "role": intern_value(role),
+        "subscription_tier": intern_value(subscription_tier),
         "onboarding_completed": False,
         "is_active": True,
-        "created_at": datetime.utcnow().isoformat(),
-        "updated_at": datetime.utcnow().isoformat(),
+        "created_at": now,
+        "updated_at": now,
     }
 
     users_db[user_id] = user
+    password_hashes[user_id] = hashed_password
+    index_user(user)
     return user
 
 
 def authenticate_user(email: str, password: str) -> Optional[Dict[str, Any]]:
-    for user in users_db.values():
-        if user["email"] == email:
-            if verify_password(password, user["hashed_password"]):
-                return user
-            return None
+    user_id = users_by_email.get(email)
+    if user_id is not None and verify_password(password, password_hashes[user_id]):
+        return users_db[user_id]
     return None
 
 
-def get_all_users() -> List[Dict[str, Any]]:
-    """Get all users (admin only)."""
-    return [
-        {k: v for k, v in user.items() if k != "hashed_password"}
-        for user in users_db.values()
-    ]
+def get_all_users() -> Iterator[Dict[str, Any]]:
+    """Yield all users (admin only)."""
+    yield from users_db.values()
 
 
 def get_user_by_id(user_id: str) -> Optional[Dict[str, Any]]:
     """Get user by ID."""
-    user = users_db.get(user_id)
-    if user:
-        return {k: v for k, v in user.items() if k != "hashed_password"}
-    return None
+    return users_db.get(user_id)
 
 
 def update_user(user_id: str, updates: Dict[str, Any]) -> Optional[Dict[str, Any]]:
@@ -210,20 +315,18 @@ def update_user(user_id: str, updates: Dict[str, Any]) -> Optional[Dict[str, Any
 
     user = users_db[user_id]
 
-    # Fields that can be updated
-    allowed_fields = [
-        "full_name", "company_name", "industry", "avatar_url",
-        "subscription_tier", "onboarding_completed", "is_active", "role"
-    ]
+    for field in _UPDATABLE_USER_FIELDS & updates.keys():
+        user[field] = updates[field]
 
-    for field in allowed_fields:
-        if field in updates:
-            user[field] = updates[field]
+    # Enum-backed fields are compared on every admin filter
+    for field in ("role", "subscription_tier"):
+        user[field] = intern_value(user[field])
 
     user["updated_at"] = datetime.utcnow().isoformat()
     users_db[user_id] = user
+    index_user(user)
 
-    return {k: v for k, v in user.items() if k != "hashed_password"}
+    return user
 
 
 def delete_user(user_id: str) -> bool:
@@ -233,6 +336,8 @@ def delete_user(user_id: str) -> bool:
 
     users_db[user_id]["is_active"] = False
     users_db[user_id]["updated_at"] = datetime.utcnow().isoformat()
+    active_user_ids.discard(user_id)
+    _bump_user_version(user_id)
     return True
 
 
@@ -0,0 +1,22 @@
+import asyncio
+from typing import Awaitable, Callable, Iterable, List, TypeVar, Union
+
+T = TypeVar("T")
+
+
+async def bounded_gather(
+    calls: Iterable[Callable[[], Awaitable[T]]],
+    limit: int,
+) -> List[Union[T, BaseException]]:
+    """Run calls concurrently with at most limit in flight.
+
+    Results come back in call order; a call that raises contributes its
+    exception instead of cancelling the rest, as with return_exceptions=True.
+    """
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run(call: Callable[[], Awaitable[T]]) -> T:
+        async with semaphore:
+            return await call()
+
+    return await asyncio.gather(*(run(call) for call in calls), return_exceptions=True)
@@ -1,13 +1,137 @@
-from openai import AsyncOpenAI
-from typing import Optional, Dict, Any, List, AsyncGenerator
+import asyncio
+import hashlib
+import httpx
+import orjson
+from cachetools import TTLCache
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
+from types import MappingProxyType
+from typing import Optional, Dict, Any, List, AsyncGenerator, Awaitable, Callable, TypeVar
 from app.config import settings
 
+T = TypeVar("T")
+
+# Errors worth retrying: rate limits, dropped connections, timeouts and 5xx
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+# Fail fast on connection setup so a bad connection is retried instead of
+# stretching time to first token; reads allow for long completions
+OPENAI_TIMEOUT = httpx.Timeout(60.0, connect=2.0)
+
+# Batch API jobs are polled with doubling waits between these bounds
+BATCH_API_ENDPOINT = "/v1/chat/completions"
+BATCH_API_POLL_INITIAL_SECONDS = 5
+BATCH_API_POLL_MAX_SECONDS = 300
+BATCH_API_FINAL_STATUSES = frozenset(("completed", "failed", "expired", "cancelled"))
+
+LENGTH_GUIDE = MappingProxyType({
+    "short": "2-3 sentences",
+    "medium": "1-2 paragraphs",
+    "long": "3-4 paragraphs with detailed information"
+})
+
+# Without an API key, descriptions stream as groups of this many words, one
+# group every MOCK_STREAM_INTERVAL seconds
+MOCK_STREAM_WORDS = 8
+MOCK_STREAM_INTERVAL = 0.02
+
+# Completion budget per description length; a tight max_tokens keeps latency down
+DESCRIPTION_MAX_TOKENS = {
+    "short": 220,
+    "medium": 380,
+    "long": 500,
+}
+# Room for a 60 character title and a 160 character description; a cut-off
+# JSON object wouldn't parse, so this keeps some headroom
+SEO_MAX_TOKENS = 120
+# Structured output schema for SEO meta content, so the reply is always this object
+SEO_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "seo_meta",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "meta_title": {"type": "string"},
+                "meta_description": {"type": "string"},
+            },
+            "required": ["meta_title", "meta_description"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+TONE_GUIDE = MappingProxyType({
+    "professional": "professional and informative",
+    "casual": "casual and approachable",
+    "luxury": "sophisticated and premium",
+    "educational": "educational and detailed"
+})
+
+# Built once; each call only formats in the product context, tone and length.
+# Everything fixed sits in the system message and the start of the prompt, ahead
+# of the per-product details, so OpenAI can reuse the cached prompt prefix
+DESCRIPTION_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": """You are an expert cannabis copywriter who creates compelling, compliant product descriptions.
+
+Guidelines:
+- Focus on the unique qualities and benefits
+- Include sensory details about aroma and flavor if applicable
+- Mention the effects and use cases
+- Be compliant with cannabis marketing regulations (no health claims)
+- Do not use terms like "cure", "treat", or make medical claims
+
+Write engaging descriptions that would appeal to cannabis consumers.""",
+}
+
+DESCRIPTION_PROMPT = """Write a compelling product description for a cannabis product.
+
+Tone: {tone}
+Length: {length}
+
+Product Information:
+{context}"""
+
+
+_openai_client: Optional[AsyncOpenAI] = None
+
+
+def get_openai_client() -> Optional[AsyncOpenAI]:
+    """Return the shared OpenAI client, or None when no API key is configured.
+
+    Every OpenAIService uses this one client, so they share a single HTTP/2
+    connection pool instead of each opening their own. A client closed at
+    shutdown is replaced on next use.
+    """
+    global _openai_client
+
+    if settings.openai_api_key and (_openai_client is None or _openai_client.is_closed()):
+        # Every call site wraps its request in call_with_retry, so the SDK's
+        # own retries are disabled
+        _openai_client = AsyncOpenAI(
+            api_key=settings.openai_api_key,
+            max_retries=0,
+            timeout=OPENAI_TIMEOUT,
+            http_client=DefaultAsyncHttpxClient(http2=True, timeout=OPENAI_TIMEOUT),
+        )
+
+    return _openai_client
+
+
+async def close_openai_client() -> None:
+    """Close the shared OpenAI client's connections."""
+    if _openai_client is not None:
+        await _openai_client.close()
+
 
 class OpenAIService:
     """Service for AI content generation using OpenAI."""
 
-    def __init__(self):
-        self.client = AsyncOpenAI(api_key=settings.openai_api_key) if settings.openai_api_key else None
+    @property
+    def client(self) -> Optional[AsyncOpenAI]:
+        return get_openai_client()
 
     async def generate_product_description(
         self,
@@ -28,7 +152,52 @@ class OpenAIService:
         if not self.client:
             return self._generate_mock_description(product_name, strain_type)
 
-        # Build context for the AI
+        context = self._build_product_context(
+            product_name=product_name,
+            product_type=product_type,
+            brand=brand,
+            strain_type=strain_type,
+            thc_percentage=thc_percentage,
+            cbd_percentage=cbd_percentage,
+            terpenes=terpenes,
+            effects=effects,
+            flavors=flavors,
+        )
+
+        response = await self.client.chat.completions.create(
+            **self._description_request(context, tone, length)
+        )
+
+        return response.choices[0].message.content
+
+    def _description_request(self, context: str, tone: str, length: str) -> Dict[str, Any]:
+        """Chat completion parameters for one product description."""
+        prompt = DESCRIPTION_PROMPT.format(
+            context=context,
+            tone=TONE_GUIDE.get(tone, "professional"),
+            length=LENGTH_GUIDE.get(length, "1-2 paragraphs"),
+        )
+
+        return {
+            "model": settings.openai_description_model,
+            "messages": [DESCRIPTION_SYSTEM_MESSAGE, {"role": "user", "content": prompt}],
+            "temperature": 0.7,
+            "max_tokens": DESCRIPTION_MAX_TOKENS.get(length, DESCRIPTION_MAX_TOKENS["medium"]),
+        }
+
+    def _build_product_context(
+        self,
+        product_name: str,
+        product_type: Optional[str] = None,
+        brand: Optional[str] = None,
+        strain_type: Optional[str] = None,
+        thc_percentage: Optional[float] = None,
+        cbd_percentage: Optional[float] = None,
+        terpenes: Optional[List[str]] = None,
+        effects: Optional[List[str]] = None,
+        flavors: Optional[List[str]] = None,
+    ) -> str:
+        """Format product attributes as prompt context."""
         context_parts = [f"Product: {product_name}"]
 
         if product_type:
@@ -48,48 +217,115 @@ class OpenAIService:
         if flavors:
             context_parts.append(f"Flavors: {', '.join(flavors)}")
 
-        context = "\n".join(context_parts)
+        return "\n".join(context_parts)
 
-        length_guide = {
-            "short": "2-3 sentences",
-            "medium": "1-2 paragraphs",
-            "long": "3-4 paragraphs with detailed information"
-        }
+    async def generate_product_descriptions_batch(
+        self,
+        items: List[Dict[str, Any]],
+        tone: str = "professional",
+        length: str = "medium",
+    ) -> List[str]:
+        """Generate descriptions for several products in one completion.
 
-        tone_guide = {
-            "professional": "professional and informative",
-            "casual": "casual and approachable",
-            "luxury": "sophisticated and premium",
-            "educational": "educational and detailed"
-        }
+        Each item takes the same attribute keys as generate_product_description.
+        Returns one description per item, in order.
+        """
 
-        prompt = f"""Write a compelling product description for a cannabis product.
+        if not self.client:
+            return [
+                self._generate_mock_description(item["product_name"], item.get("strain_type"))
+                for item in items
+            ]
+
+        products = "\n\n".join(
+            f"Product {n}:\n{self._build_product_context(**item)}"
+            for n, item in enumerate(items, 1)
+        )
 
-Product Information:
-{context}
+        prompt = f"""Write a compelling product description for each of these {len(items)} cannabis products.
 
-Guidelines:
-- Tone: {tone_guide.get(tone, 'professional')}
-- Length: {length_guide.get(length, '1-2 paragraphs')}
-- Focus on the unique qualities and benefits
-- Include sensory details about aroma and flavor if applicable
-- Mention the effects and use cases
-- Be compliant with cannabis marketing regulations (no health claims)
-- Do not use terms like "cure", "treat", or make medical claims
+Tone: {TONE_GUIDE.get(tone, 'professional')}
+Length: {LENGTH_GUIDE.get(length, '1-2 paragraphs')} per product
+
+Respond with a JSON object of the form {{"descriptions": ["...", ...]}} containing exactly
+{len(items)} descriptions, in the same order as the products below.
 
-Write an engaging description that would appeal to cannabis consumers."""
+{products}"""
 
         response = await self.client.chat.completions.create(
-            model="gpt-4-turbo-preview",
+            model=settings.openai_description_model,
             messages=[
-                {"role": "system", "content": "You are an expert cannabis copywriter who creates compelling, compliant product descriptions."},
+                DESCRIPTION_SYSTEM_MESSAGE,
                 {"role": "user", "content": prompt}
             ],
             temperature=0.7,
-            max_tokens=500,
+            max_tokens=min(DESCRIPTION_MAX_TOKENS.get(length, DESCRIPTION_MAX_TOKENS["medium"]) * len(items), 4096),
+            response_format={"type": "json_object"},
         )
 
-        return response.choices[0].message.content
+        descriptions = orjson.loads(response.choices[0].message.content).get("descriptions")
+        if not isinstance(descriptions, list) or len(descriptions) != len(items):
+            raise ValueError("Batch response did not contain one description per product")
+        return [str(description) for description in descriptions]
+
+    async def generate_product_descriptions_batch_api(
+        self,
+        items: Dict[str, Dict[str, Any]],
+        tone: str = "professional",
+        length: str = "medium",
+    ) -> Dict[str, str]:
+        """Generate descriptions through an OpenAI Batch API job.
+
+        items maps an id (used as the batch custom_id) to the same attribute
+        keys as generate_product_description. Waits for the job to finish and
+        returns a description per id; ids whose request failed are left out.
+        """
+
+        if not self.client:
+            return {
+                item_id: self._generate_mock_description(item["product_name"], item.get("strain_type"))
+                for item_id, item in items.items()
+            }
+
+        lines = b"\n".join(
+            orjson.dumps({
+                "custom_id": item_id,
+                "method": "POST",
+                "url": BATCH_API_ENDPOINT,
+                "body": self._description_request(self._build_product_context(**item), tone, length),
+            })
+            for item_id, item in items.items()
+        )
+        input_file = await call_with_retry(lambda: self.client.files.create(
+            file=("product-descriptions.jsonl", lines),
+            purpose="batch",
+        ))
+        batch = await call_with_retry(lambda: self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_API_ENDPOINT,
+            completion_window="24h",
+        ))
+
+        delay = BATCH_API_POLL_INITIAL_SECONDS
+        while batch.status not in BATCH_API_FINAL_STATUSES:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, BATCH_API_POLL_MAX_SECONDS)
+            batch = await call_with_retry(lambda: self.client.batches.retrieve(batch.id))
+
+        # Expired and cancelled jobs still return the requests that finished
+        if not batch.output_file_id:
+            raise RuntimeError(f"Description batch {batch.id} ended as {batch.status} with no output")
+
+        output = await call_with_retry(lambda: self.client.files.content(batch.output_file_id))
+        descriptions = {}
+        for line in output.content.splitlines():
+            if not line.strip():
+                continue
+            row = orjson.loads(line)
+            response = row.get("response") or {}
+            if response.get("status_code") == 200:
+                descriptions[row["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+        return descriptions
 
     async def generate_product_description_stream(
         self,
@@ -100,41 +336,23 @@ Write an engaging description that would appeal to cannabis consumers."""
 
         if not self.client:
             # Mock streaming for development
-            mock_text = self._generate_mock_description(product_name, kwargs.get("strain_type"))
-            for word in mock_text.split():
-                yield word + " "
+            words = self._generate_mock_description(product_name, kwargs.get("strain_type")).split()
+            for i in range(0, len(words), MOCK_STREAM_WORDS):
+                yield " ".join(words[i:i + MOCK_STREAM_WORDS]) + " "
+                # Roughly the cadence of a real stream
+                await asyncio.sleep(MOCK_STREAM_INTERVAL)
             return
 
-        # Build the same prompt as above
-        context_parts = [f"Product: {product_name}"]
-        for key, value in kwargs.items():
-            if value and key not in ["tone", "length"]:
-                if isinstance(value, list):
-                    context_parts.append(f"{key.replace('_', ' ').title()}: {', '.join(value)}")
-                else:
-                    context_parts.append(f"{key.replace('_', ' ').title()}: {value}")
-
-        context = "\n".join(context_parts)
-        tone = kwargs.get("tone", "professional")
-        length = kwargs.get("length", "medium")
-
-        prompt = f"""Write a compelling product description for a cannabis product.
-
-Product Information:
-{context}
-
-Write an engaging, {tone} description in {length} length."""
+        tone = kwargs.pop("tone", "professional")
+        length = kwargs.pop("length", "medium")
+        context = self._build_product_context(product_name=product_name, **kwargs)
 
-        stream = await self.client.chat.completions.create(
-            model="gpt-4-turbo-preview",
-            messages=[
-                {"role": "system", "content": "You are an expert cannabis copywriter."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=500,
+        # Retries only cover opening the stream; once tokens have been yielded a
+        # failure can't be retried without repeating them
+        stream = await call_with_retry(lambda: self.client.chat.completions.create(
+            **self._description_request(context, tone, length),
             stream=True,
-        )
+        ))
 
         async for chunk in stream:
             if chunk.choices[0].delta.content:
@@ -160,51 +378,88 @@ Description: {description}
 
 Provide:
 1. Meta Title (50-60 characters)
-2. Meta Description (150-160 characters)
-
-Format your response as:
-META_TITLE: [title]
-META_DESCRIPTION: [description]"""
+2. Meta Description (150-160 characters)"""
 
         response = await self.client.chat.completions.create(
-            model="gpt-4-turbo-preview",
+            model=settings.openai_seo_model,
             messages=[{"role": "user", "content": prompt}],
             temperature=0.5,
-            max_tokens=200,
+            max_tokens=SEO_MAX_TOKENS,
+            response_format=SEO_RESPONSE_FORMAT,
         )
 
-        content = response.choices[0].message.content
-
-        # Parse the response
-        meta_title = ""
-        meta_description = ""
-
-        for line in content.split("\n"):
-            if line.startswith("META_TITLE:"):
-                meta_title = line.replace("META_TITLE:", "").strip()
-            elif line.startswith("META_DESCRIPTION:"):
-                meta_description = line.replace("META_DESCRIPTION:", "").strip()
-
+        meta = orjson.loads(response.choices[0].message.content)
         return {
-            "meta_title": meta_title,
-            "meta_description": meta_description
+            "meta_title": str(meta.get("meta_title") or ""),
+            "meta_description": str(meta.get("meta_description") or ""),
         }
 
     def _generate_mock_description(self, product_name: str, strain_type: Optional[str] = None) -> str:
         """Generate a mock description for development without API key."""
-        strain_descriptions = {
-            "indica": "Known for its deeply relaxing effects, this indica-dominant strain offers a calming experience perfect for unwinding after a long day. With earthy undertones and a smooth finish, it's ideal for evening use.",
-            "sativa": "This uplifting sativa strain delivers an energizing experience that sparks creativity and focus. Featuring bright citrus notes and a euphoric onset, it's perfect for daytime activities and social gatherings.",
-            "hybrid": "A perfectly balanced hybrid that offers the best of both worlds - the uplifting energy of sativa combined with the relaxing body effects of indica. Expect a well-rounded experience with complex flavor profiles.",
-            "cbd": "This CBD-rich strain provides therapeutic benefits without intense psychoactive effects. Perfect for those seeking relief while maintaining clarity and focus throughout their day."
-        }
-
-        base_desc = strain_descriptions.get(
+        return product_name + _MOCK_DESCRIPTION_TAILS.get(
             strain_type.lower() if strain_type else "hybrid",
-            strain_descriptions["hybrid"]
+            _MOCK_DESCRIPTION_TAILS["hybrid"]
         )
 
-        return f"{product_name}\n\n{base_desc}\n\nExperience the quality difference with our carefully cultivated products, rigorously tested for purity and potency."
+
+# Mock description bodies per strain type, everything after the product name
+_MOCK_DESCRIPTION_TAILS = {
+    strain: f"\n\n{description}\n\nExperience the quality difference with our carefully cultivated products, rigorously tested for purity and potency."
+    for strain, description in {
+        "indica": "Known for its deeply relaxing effects, this indica-dominant strain offers a calming experience perfect for unwinding after a long day. With earthy undertones and a smooth finish, it's ideal for evening use.",
+        "sativa": "This uplifting sativa strain delivers an energizing experience that sparks creativity and focus. Featuring bright citrus notes and a euphoric onset, it's perfect for daytime activities and social gatherings.",
+        "hybrid": "A perfectly balanced hybrid that offers the best of both worlds - the uplifting energy of sativa combined with the relaxing body effects of indica. Expect a well-rounded experience with complex flavor profiles.",
+        "cbd": "This CBD-rich strain provides therapeutic benefits without intense psychoactive effects. Perfect for those seeking relief while maintaining clarity and focus throughout their day."
+    }.items()
+}
+
+
+async def call_with_retry(call: Callable[[], Awaitable[T]]) -> T:
+    """Await call(), retrying transient OpenAI errors with jittered exponential backoff.
+
+    Once all attempts are used up the last error is re-raised.
+    """
+    async for attempt in AsyncRetrying(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential_jitter(initial=0.5, max=8),
+        retry=retry_if_exception_type(RETRYABLE_ERRORS),
+        reraise=True,
+    ):
+        with attempt:
+            return await call()
+
+
+# Responses for identical generation requests, keyed by a hash of the inputs
+LLM_CACHE_MAX_SIZE = 2048
+_llm_cache: TTLCache = TTLCache(maxsize=LLM_CACHE_MAX_SIZE, ttl=settings.llm_cache_ttl_seconds)
+
+
+def llm_cache_key(name: str, params: Dict[str, Any]) -> str:
+    """Content-addressed cache key for a generation call."""
+    raw = orjson.dumps({"ep": name, "req": params}, option=orjson.OPT_SORT_KEYS)
+    return "llm:v1:" + hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+async def cached_llm_call(
+    name: str,
+    params: Dict[str, Any],
+    call: Callable[[], Awaitable[T]],
+    on_miss: Optional[Callable[[], None]] = None,
+) -> T:
+    """Return the cached result for these inputs, or run call() with retries and cache it.
+
+    on_miss runs before call() on a cache miss (e.g. to charge a quota); if it
+    raises, call() isn't made.
+    """
+    key = llm_cache_key(name, params)
+    hit = _llm_cache.get(key)
+    if hit is not None:
+        return hit
+    if on_miss is not None:
+        on_miss()
+    result = await call_with_retry(call)
+    _llm_cache[key] = result
+    return result
 
 
 # Singleton instance
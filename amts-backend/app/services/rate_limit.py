@@ -0,0 +1,60 @@
+import time
+from typing import Dict, Any, Optional
+
+from fastapi import HTTPException, status
+from limits import RateLimitItem, parse
+from limits.storage import storage_from_string
+from limits.strategies import FixedWindowRateLimiter
+
+from app.config import settings
+from app.models.subscription import SubscriptionTier, TIER_AI_GENERATION_LIMITS
+
+# Quota window for AI generations; the counts come from the plan table
+AI_QUOTA_WINDOW = "hour"
+# Per-tier generation limits from TIER_AI_GENERATION_LIMITS; None for unlimited tiers (-1)
+AI_TIER_LIMITS: Dict[str, Optional[RateLimitItem]] = {
+    tier: parse(f"{amount}/{AI_QUOTA_WINDOW}") if amount >= 0 else None
+    for tier, amount in TIER_AI_GENERATION_LIMITS.items()
+}
+
+_ai_limiter = FixedWindowRateLimiter(storage_from_string(settings.ai_rate_limit_storage_uri))
+
+
+def ai_limit_for(user: Dict[str, Any]) -> Optional[RateLimitItem]:
+    """The user's quota, or None if their tier is unlimited; unknown tiers get the free quota."""
+    tier = user.get("subscription_tier")
+    if tier not in AI_TIER_LIMITS:
+        tier = SubscriptionTier.FREE.value
+    return AI_TIER_LIMITS[tier]
+
+
+def get_ai_usage(user: Dict[str, Any]) -> Dict[str, Any]:
+    """Current window usage of the user's AI quota; limit is -1 for unlimited tiers."""
+    limit = ai_limit_for(user)
+    if limit is None:
+        return {"limit": -1, "remaining": -1, "reset_at": None}
+    reset_time, remaining = _ai_limiter.get_window_stats(limit, "ai", user["id"])
+    return {
+        "limit": limit.amount,
+        "remaining": remaining,
+        "reset_at": reset_time,
+    }
+
+
+def charge_ai_quota(user: Dict[str, Any], cost: int = 1) -> None:
+    """Count cost generations against the user's quota, raising 429 once it's used up.
+
+    Call this from the handler once the request is known to reach OpenAI
+    (body validated, products found, no cache hit), so rejected requests
+    don't use up generations.
+    """
+    limit = ai_limit_for(user)
+    if limit is None or _ai_limiter.hit(limit, "ai", user["id"], cost=cost):
+        return
+    reset_time, _ = _ai_limiter.get_window_stats(limit, "ai", user["id"])
+    raise HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=f"AI generation limit reached ({limit.amount} per {limit.GRANULARITY.name})",
+        headers={"Retry-After": str(max(1, int(reset_time - time.time()) + 1))},
+    )
+
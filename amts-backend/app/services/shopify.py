@@ -2,10 +2,205 @@ import httpx
 import hmac
 import hashlib
 import base64
-from typing import Optional, Dict, Any, List
+import binascii
+import asyncio
+import random
+import time
+import orjson
+from cachetools import LRUCache, TTLCache
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt
+from typing import Optional, Dict, Any, List, AsyncIterator, Tuple
 from urllib.parse import urlencode
 from app.config import settings
 
+# Every product field the product sync reads, as one bulk operation query
+BULK_PRODUCTS_QUERY = """
+{
+  products {
+    edges {
+      node {
+        id
+        title
+        descriptionHtml
+        vendor
+        productType
+        tags
+        status
+        variants {
+          edges { node { id price compareAtPrice sku barcode inventoryQuantity } }
+        }
+        images {
+          edges { node { id url } }
+        }
+      }
+    }
+  }
+}
+"""
+
+RUN_BULK_QUERY_MUTATION = """
+mutation RunBulkQuery($query: String!) {
+  bulkOperationRunQuery(query: $query) {
+    bulkOperation { id status }
+    userErrors { field message }
+  }
+}
+"""
+
+CURRENT_BULK_OPERATION_QUERY = """
+{
+  currentBulkOperation { id status errorCode objectCount url }
+}
+"""
+
+# Bulk operation status polling: first delay, backoff factor, cap and overall limit (seconds)
+BULK_POLL_INITIAL = 1.0
+BULK_POLL_FACTOR = 1.5
+BULK_POLL_MAX = 15.0
+BULK_POLL_TIMEOUT = 30 * 60
+# Each wait is scaled by a random factor in 1 +/- BULK_POLL_JITTER so syncs for
+# many shops started together don't poll in lockstep
+BULK_POLL_JITTER = 0.2
+
+
+# Connection pool shared by every Shopify call, so requests reuse TLS connections.
+# HTTP/2 lets concurrent calls to one shop share a single connection
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+HTTP_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the shared HTTP client, creating it on first use."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(http2=True, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+    return _http_client
+
+
+async def close_http_client() -> None:
+    """Close the shared HTTP client and its pooled connections."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+# Shopify's REST bucket holds 40 calls per shop and leaks at 2/s. Each shop gets
+# at most SHOPIFY_MAX_IN_FLIGHT concurrent calls, and a local copy of its bucket
+# (corrected from X-Shopify-Shop-Api-Call-Limit on every response) holds calls
+# back while it is full, rather than bursting into 429s
+SHOPIFY_MAX_IN_FLIGHT = 4
+SHOPIFY_BUCKET_SIZE = 40
+SHOPIFY_LEAK_RATE = 2.0
+# Attempts per call when Shopify answers 429, waiting Retry-After (or 1s, 2s, 4s
+# without one) between them
+SHOPIFY_MAX_ATTEMPTS = 4
+
+
+class _ShopLimiter:
+    """Concurrency slots plus a leaky-bucket mirror for one shop's REST calls."""
+
+    __slots__ = ("slots", "level", "size", "updated")
+
+    def __init__(self) -> None:
+        self.slots = asyncio.Semaphore(SHOPIFY_MAX_IN_FLIGHT)
+        self.level = 0.0
+        self.size = SHOPIFY_BUCKET_SIZE
+        self.updated = time.monotonic()
+
+    def _leak(self) -> None:
+        now = time.monotonic()
+        self.level = max(0.0, self.level - (now - self.updated) * SHOPIFY_LEAK_RATE)
+        self.updated = now
+
+    async def take(self) -> None:
+        """Wait until the bucket has room for one more call, then count it."""
+        self._leak()
+        overflow = self.level + 1 - self.size
+        if overflow > 0:
+            await asyncio.sleep(overflow / SHOPIFY_LEAK_RATE)
+            self._leak()
+        self.level += 1
+
+    def observe(self, response: httpx.Response) -> None:
+        """Sync the bucket with the level Shopify reports."""
+        call_limit = _bucket_level(response)
+        if call_limit is not None:
+            self._leak()
+            self.level, self.size = call_limit
+
+
+# Limiters for the most recently used shops; an evicted shop starts over with
+# an empty local bucket, which the next response's call-limit header corrects
+SHOP_LIMITERS_MAX_SIZE = 1024
+_shop_limiters: LRUCache = LRUCache(maxsize=SHOP_LIMITERS_MAX_SIZE)
+
+
+def _shop_limiter(shop_domain: str) -> _ShopLimiter:
+    limiter = _shop_limiters.get(shop_domain)
+    if limiter is None:
+        limiter = _shop_limiters[shop_domain] = _ShopLimiter()
+    return limiter
+
+
+def _is_throttled(error: BaseException) -> bool:
+    return isinstance(error, httpx.HTTPStatusError) and error.response.status_code == 429
+
+
+def _wait_retry_after(retry_state) -> float:
+    """Honour Shopify's Retry-After on a 429, else back off exponentially."""
+    backoff = float(2 ** (retry_state.attempt_number - 1))
+    response = retry_state.outcome.exception().response
+    try:
+        return float(response.headers.get("Retry-After", backoff))
+    except ValueError:
+        return backoff
+
+
+def _bucket_level(response: httpx.Response) -> Optional[Tuple[int, int]]:
+    """(used, size) of the shop's REST bucket, from X-Shopify-Shop-Api-Call-Limit ("32/40")."""
+    call_limit = response.headers.get("X-Shopify-Shop-Api-Call-Limit")
+    if not call_limit:
+        return None
+    try:
+        used, size = call_limit.split("/", 1)
+        return int(used), int(size)
+    except ValueError:
+        return None
+
+
+# (url, params) -> (ETag, parsed body) of recent Shopify GETs, for conditional requests
+ETAG_CACHE_MAX_SIZE = 2048
+ETAG_CACHE_TTL_SECONDS = 600
+_etag_cache: TTLCache = TTLCache(maxsize=ETAG_CACHE_MAX_SIZE, ttl=ETAG_CACHE_TTL_SECONDS)
+
+# Keyed once; each webhook copies it rather than re-deriving the HMAC key pads
+_WEBHOOK_HMAC = hmac.new(settings.shopify_api_secret.encode("utf-8"), digestmod=hashlib.sha256)
+
+
+def _attach_bulk_child(product: Dict[str, Any], row: Dict[str, Any]) -> None:
+    """Add a bulk result variant or image line to its product, in the REST shape."""
+    if "/ProductVariant/" in row["id"]:
+        product["variants"].append({
+            "price": row.get("price"),
+            "compare_at_price": row.get("compareAtPrice"),
+            "sku": row.get("sku"),
+            "barcode": row.get("barcode"),
+            "inventory_quantity": row.get("inventoryQuantity"),
+        })
+    else:
+        product["images"].append({"src": row.get("url")})
+
+
+class BulkOperationRejected(ValueError):
+    """Shopify refused to start a bulk operation, e.g. because one is already running."""
+
+
+def _gid_to_id(gid: str) -> str:
+    """Numeric id from a GraphQL global id, as used by the REST API."""
+    return gid.rsplit("/", 1)[-1]
+
 
 class ShopifyService:
     """Service for interacting with Shopify API."""
@@ -36,48 +231,198 @@ class ShopifyService:
             "code": code,
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=payload)
-            response.raise_for_status()
-            return response.json()
+        response = await get_http_client().post(
+            url,
+            content=orjson.dumps(payload),
+            headers={"Content-Type": "application/json"},
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)
 
-    def verify_webhook(self, data: bytes, hmac_header: str) -> bool:
+    def verify_webhook(self, data: bytes, hmac_header: Optional[str]) -> bool:
         """Verify Shopify webhook signature."""
-        digest = hmac.new(
-            settings.shopify_api_secret.encode("utf-8"),
-            data,
-            hashlib.sha256
-        ).digest()
-        computed_hmac = base64.b64encode(digest).decode("utf-8")
-        return hmac.compare_digest(computed_hmac, hmac_header)
+        # A missing X-Shopify-Hmac-Sha256 header fails without hashing the body
+        if not hmac_header:
+            return False
+        try:
+            expected = base64.b64decode(hmac_header, validate=True)
+        except (binascii.Error, ValueError):
+            return False
+        mac = _WEBHOOK_HMAC.copy()
+        mac.update(data)
+        return hmac.compare_digest(mac.digest(), expected)
 
-    async def _request(
+    async def _send(
         self,
         method: str,
-        endpoint: str,
+        url: str,
         data: Optional[Dict] = None,
-        params: Optional[Dict] = None
-    ) -> Dict[str, Any]:
-        """Make authenticated request to Shopify API."""
+        params: Optional[Dict] = None,
+        extra_headers: Optional[Dict[str, str]] = None,
+    ) -> httpx.Response:
+        """Make authenticated request to Shopify API and return the raw response.
+
+        A 304 Not Modified is returned as-is rather than raised.
+        """
         if not self.access_token:
             raise ValueError("Access token required for API requests")
 
-        url = f"{self.base_url}/{endpoint}"
         headers = {
             "X-Shopify-Access-Token": self.access_token,
             "Content-Type": "application/json",
         }
+        if extra_headers:
+            headers.update(extra_headers)
+
+        body = orjson.dumps(data) if data is not None else None
+        limiter = _shop_limiter(self.shop_domain)
+        # GraphQL is limited by query cost, not the REST call bucket
+        rest_call = not url.endswith("/graphql.json")
+
+        async for attempt in AsyncRetrying(
+            stop=stop_after_attempt(SHOPIFY_MAX_ATTEMPTS),
+            wait=_wait_retry_after,
+            retry=retry_if_exception(_is_throttled),
+            reraise=True,
+        ):
+            with attempt:
+                async with limiter.slots:
+                    if rest_call:
+                        await limiter.take()
+                    response = await get_http_client().request(
+                        method,
+                        url,
+                        headers=headers,
+                        content=body,
+                        params=params
+                    )
+                    limiter.observe(response)
+                if response.status_code != httpx.codes.NOT_MODIFIED:
+                    response.raise_for_status()
+        return response
 
-        async with httpx.AsyncClient() as client:
-            response = await client.request(
-                method,
-                url,
-                headers=headers,
-                json=data,
-                params=params
-            )
+    async def _request(
+        self,
+        method: str,
+        endpoint: str,
+        data: Optional[Dict] = None,
+        params: Optional[Dict] = None
+    ) -> Dict[str, Any]:
+        """Make authenticated request to Shopify API.
+
+        GETs are sent conditionally when an earlier response had an ETag, and a
+        304 is answered from that response; treat GET results as read-only.
+        """
+        url = f"{self.base_url}/{endpoint}"
+        if method != "GET":
+            response = await self._send(method, url, data, params)
+            return orjson.loads(response.content)
+
+        key = (url, tuple(sorted(params.items())) if params else ())
+        cached = _etag_cache.get(key)
+        response = await self._send(
+            method, url, data, params,
+            {"If-None-Match": cached[0]} if cached else None,
+        )
+        if response.status_code == httpx.codes.NOT_MODIFIED and cached:
+            return cached[1]
+        result = orjson.loads(response.content)
+        etag = response.headers.get("ETag")
+        if etag:
+            _etag_cache[key] = (etag, result)
+        return result
+
+    async def graphql(self, query: str, variables: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Run an Admin GraphQL query and return its data."""
+        result = await self._request("POST", "graphql.json", data={"query": query, "variables": variables or {}})
+        if result.get("errors"):
+            raise ValueError(f"Shopify GraphQL error: {result['errors']}")
+        return result["data"]
+
+    async def run_bulk_query(self, query: str) -> Optional[str]:
+        """Run a bulk operation and wait for it, returning the JSONL result URL.
+
+        The URL is None when the query matched nothing.
+        """
+        data = await self.graphql(RUN_BULK_QUERY_MUTATION, {"query": query})
+        user_errors = data["bulkOperationRunQuery"]["userErrors"]
+        if user_errors:
+            raise BulkOperationRejected(f"Bulk operation rejected: {user_errors}")
+        operation_id = data["bulkOperationRunQuery"]["bulkOperation"]["id"]
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + BULK_POLL_TIMEOUT
+        delay = BULK_POLL_INITIAL
+        while True:
+            await asyncio.sleep(delay * random.uniform(1 - BULK_POLL_JITTER, 1 + BULK_POLL_JITTER))
+            operation = (await self.graphql(CURRENT_BULK_OPERATION_QUERY))["currentBulkOperation"]
+            if operation is None or operation["id"] != operation_id:
+                raise ValueError("Bulk operation was replaced before it finished")
+            if operation["status"] == "COMPLETED":
+                return operation["url"]
+            if operation["status"] in ("FAILED", "CANCELED", "EXPIRED"):
+                raise ValueError(f"Bulk operation {operation['status'].lower()}: {operation['errorCode']}")
+            if loop.time() > deadline:
+                raise TimeoutError("Bulk operation did not finish in time")
+            delay = min(delay * BULK_POLL_FACTOR, BULK_POLL_MAX)
+
+    async def iter_bulk_results(self, url: str) -> AsyncIterator[Dict[str, Any]]:
+        """Stream the objects of a bulk operation's JSONL result."""
+        async with get_http_client().stream("GET", url) as response:
             response.raise_for_status()
-            return response.json()
+            async for line in response.aiter_lines():
+                if line:
+                    yield orjson.loads(line)
+
+    async def bulk_export_products(self) -> AsyncIterator[Dict[str, Any]]:
+        """Yield every product in the store via a bulk operation, in the REST product shape.
+
+        Bulk results list each product and its variants and images as separate
+        lines linked by __parentId. Products are assembled as the lines stream
+        in and yielded once the whole result has been read, since a child line
+        isn't guaranteed to follow its product directly.
+        """
+        try:
+            url = await self.run_bulk_query(BULK_PRODUCTS_QUERY)
+        except BulkOperationRejected:
+            # Shopify runs one bulk query per shop at a time; page through REST instead
+            async for page in self.iter_products():
+                for product in page:
+                    yield product
+            return
+        if url is None:
+            return
+
+        # Products by GID in result order. Child lines are attached through
+        # their __parentId, and children seen before their product are held in
+        # orphans until it arrives, so an out-of-order line can't land on the
+        # wrong product
+        products: Dict[str, Dict[str, Any]] = {}
+        orphans: Dict[str, List[Dict[str, Any]]] = {}
+        async for row in self.iter_bulk_results(url):
+            parent_id = row.get("__parentId")
+            if parent_id is None:
+                product = products[row["id"]] = {
+                    "id": _gid_to_id(row["id"]),
+                    "title": row.get("title"),
+                    "body_html": row.get("descriptionHtml"),
+                    "vendor": row.get("vendor"),
+                    "product_type": row.get("productType"),
+                    "tags": ", ".join(row.get("tags") or ()),
+                    "status": (row.get("status") or "").lower(),
+                    "variants": [],
+                    "images": [],
+                }
+                for child in orphans.pop(row["id"], ()):
+                    _attach_bulk_child(product, child)
+            elif parent_id in products:
+                _attach_bulk_child(products[parent_id], row)
+            else:
+                orphans.setdefault(parent_id, []).append(row)
+
+        # Children whose product never appeared have nothing to attach to
+        for product in products.values():
+            yield product
 
     async def get_shop(self) -> Dict[str, Any]:
         """Get shop information."""
@@ -94,6 +439,25 @@ class ShopifyService:
             params["page_info"] = page_info
         return await self._request("GET", "products.json", params=params)
 
+    async def iter_products(self, limit: int = 250) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Yield every page of products, following the Link header cursors.
+
+        The next page is requested before the current one is handed over, so
+        fetching overlaps with whatever the caller does with each page.
+        """
+        pending = asyncio.ensure_future(
+            self._send("GET", f"{self.base_url}/products.json", params={"limit": limit})
+        )
+        try:
+            while pending is not None:
+                response = await pending
+                next_url = response.links.get("next", {}).get("url")
+                pending = asyncio.ensure_future(self._send("GET", next_url)) if next_url else None
+                yield orjson.loads(response.content).get("products", [])
+        finally:
+            if pending is not None and not pending.done():
+                pending.cancel()
+
     async def get_product(self, product_id: str) -> Dict[str, Any]:
         """Get a single product."""
         return await self._request("GET", f"products/{product_id}.json")
@@ -166,14 +530,18 @@ class ShopifyService:
         )
 
 
-# Store connections in memory (will be replaced with database)
-store_connections: Dict[str, ShopifyService] = {}
+# Store connections in memory (will be replaced with database). Services hold
+# no sockets of their own (calls share the pooled client), so the least recently
+# used ones are simply dropped and rebuilt from the stored token on next use
+STORE_CONNECTIONS_MAX_SIZE = 1024
+store_connections: LRUCache = LRUCache(maxsize=STORE_CONNECTIONS_MAX_SIZE)
 
 
 def get_shopify_service(shop_domain: str, access_token: Optional[str] = None) -> ShopifyService:
     """Get or create a Shopify service instance."""
-    if shop_domain in store_connections:
-        return store_connections[shop_domain]
+    service = store_connections.get(shop_domain)
+    if service is not None:
+        return service
 
     service = ShopifyService(shop_domain, access_token)
     if access_token: